@@ -0,0 +1,317 @@
+"""
+Offline benchmark of the path computation, without Mininet or POX running.
+
+Builds the topologies as plain adjacency dictionaries, in the same format
+as Controller.store.topology (dpid -> set of (neighbor, port)), and times:
+  update        ECMPUtil.update over the whole topology
+  get_path      a path query between every pair of edge switches
+  link_failure  removing a link used by the paths, failing over to
+                disjoint backups and adding the link back
+  link_failure_per_flow
+                the same with FLOWS_PER_PAIR hashed paths per pair, as
+                in --per_flow mode
+  l2_multi      pox.forwarding.l2_multi._calc_paths and its path queries
+                (only when POX can be imported, from ../pox or the python path)
+
+Usage:
+  python benchmark.py [--topology=fat_tree:4,leaf_spine:4:8,levels:3]
+                      [--save-baseline] [--baseline=benchmark_baselines.json]
+"""
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import timeit
+
+from extensions.ecmp_utils import ECMPUtil
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+DEFAULT_TOPOLOGIES = "levels:3,fat_tree:4,fat_tree:8,leaf_spine:4:16"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "benchmark_baselines.json")
+# POX checkout of the repository, used for the l2_multi case
+POX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pox")
+# Amount of links failed in the link_failure case
+LINK_FAILURES = 50
+# Flows of each pair of edge switches in the link_failure_per_flow case
+FLOWS_PER_PAIR = 8
+# Floyd-Warshall is cubic, bigger topologies are skipped
+L2_MULTI_MAX_SWITCHES = 200
+
+
+class TopologyBuilder():
+    """
+    Builds a topology dictionary dpid -> set of (neighbor, port), numbering
+    the switches from 1 and the ports of each switch from 1
+    """
+    def __init__(self):
+        self.topology = {}
+        self.next_port = {}
+        self.next_dpid = 1
+
+    def add_switch(self):
+        dpid = self.next_dpid
+        self.next_dpid += 1
+        self.topology[dpid] = set()
+        self.next_port[dpid] = 1
+        return dpid
+
+    def add_switches(self, amount):
+        return [self.add_switch() for _ in range(amount)]
+
+    def add_link(self, sw1, sw2):
+        self.topology[sw1].add((sw2, self.next_port[sw1]))
+        self.topology[sw2].add((sw1, self.next_port[sw2]))
+        self.next_port[sw1] += 1
+        self.next_port[sw2] += 1
+
+
+def levels_topology(levels):
+    """
+    Same shape as topology/datacenter.py Datacenter: 2^level switches on each
+    level and every switch linked with every switch of the next level.
+    Hosts are at the root and at the last level.
+    """
+    builder = TopologyBuilder()
+    by_level = [builder.add_switches(2 ** level) for level in range(levels)]
+    for upper, lower in zip(by_level[:-1], by_level[1:]):
+        for sw1 in upper:
+            for sw2 in lower:
+                builder.add_link(sw1, sw2)
+    edges = sorted(set(by_level[0] + by_level[-1]))
+    return builder.topology, edges
+
+
+def fat_tree_topology(k):
+    """k-ary fat-tree: k pods of k/2 aggregation and k/2 edge switches, (k/2)^2 cores"""
+    half = k // 2
+    builder = TopologyBuilder()
+    cores = builder.add_switches(half * half)
+    edges = []
+    for _ in range(k):
+        aggregations = builder.add_switches(half)
+        pod_edges = builder.add_switches(half)
+        for i, aggregation in enumerate(aggregations):
+            for edge in pod_edges:
+                builder.add_link(aggregation, edge)
+            for core in cores[i * half:(i + 1) * half]:
+                builder.add_link(aggregation, core)
+        edges.extend(pod_edges)
+    return builder.topology, edges
+
+
+def leaf_spine_topology(spines, leaves):
+    """Every leaf linked with every spine, hosts are at the leaves"""
+    builder = TopologyBuilder()
+    spine_switches = builder.add_switches(spines)
+    leaf_switches = builder.add_switches(leaves)
+    for leaf in leaf_switches:
+        for spine in spine_switches:
+            builder.add_link(leaf, spine)
+    return builder.topology, leaf_switches
+
+
+GENERATORS = {
+    'levels': levels_topology,
+    'fat_tree': fat_tree_topology,
+    'leaf_spine': leaf_spine_topology,
+}
+
+
+def build_topology(spec):
+    """Builds a topology from a spec like fat_tree:4"""
+    parts = spec.split(":")
+    return GENERATORS[parts[0]](*[int(part) for part in parts[1:]])
+
+
+class Measure():
+    """
+    Times each operation of a case, or tracks the peak memory of the whole
+    case. Both are not done on the same run since tracing the memory slows
+    down every allocation.
+    """
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.latencies = []
+        self.peak_memory = 0
+
+    def __enter__(self):
+        gc.collect()
+        if not self.track_memory:
+            return self
+        if tracemalloc:
+            tracemalloc.start()
+        else:
+            self.start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self
+
+    def __exit__(self, *args):
+        if not self.track_memory:
+            return
+        if tracemalloc:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            # ru_maxrss is in kilobytes and only grows, so this is a rough value
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak_memory = (rss - self.start_rss) * 1024
+
+    def time(self, function, *args):
+        start = timeit.default_timer()
+        result = function(*args)
+        self.latencies.append(timeit.default_timer() - start)
+        return result
+
+    def result(self, peak_memory):
+        latencies = sorted(self.latencies)
+        total = sum(latencies)
+        return {
+            'ops': len(latencies),
+            'ops_per_sec': len(latencies) / total if total else 0,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+            'peak_memory_kb': peak_memory // 1024,
+        }
+
+
+def edge_pairs(edges):
+    return [(src, dst) for src in edges for dst in edges if src != dst]
+
+
+def bench_update(topology, edges, measure):
+    with measure:
+        for _ in range(5):
+            measure.time(ECMPUtil().update, topology)
+    return measure
+
+
+def bench_get_path(topology, edges, measure):
+    ecmp = ECMPUtil(max_paths=len(edges) ** 2)
+    ecmp.update(topology)
+    with measure:
+        for src, dst in edge_pairs(edges):
+            measure.time(ecmp.get_path, src, dst)
+    return measure
+
+
+def bench_link_failure(topology, edges, measure, flows_per_pair=0):
+    ecmp = ECMPUtil(max_paths=len(edges) ** 2 * max(flows_per_pair, 1))
+    ecmp.update(topology)
+    for src, dst in edge_pairs(edges):
+        if not flows_per_pair:
+            ecmp.get_path(src, dst)
+        for flow_hash in range(flows_per_pair):
+            ecmp.get_path(src, dst, flow_hash)
+    links = sorted(ecmp.paths_by_link)
+    random.seed(0)
+    failures = random.sample(links, min(LINK_FAILURES, len(links)))
+
+    def fail(origin, end):
+        port = ecmp.ports[(origin, end)]
+        for key, old_path in ecmp.remove_link(origin, end).items():
+            if not ecmp.use_backup(key, old_path):
+                ecmp.get_path(*key)
+        ecmp.add_link(origin, end, port)
+
+    with measure:
+        for origin, end in failures:
+            measure.time(fail, origin, end)
+    return measure
+
+
+def bench_link_failure_per_flow(topology, edges, measure):
+    return bench_link_failure(topology, edges, measure, FLOWS_PER_PAIR)
+
+
+def bench_l2_multi(topology, edges, measure):
+    if len(topology) > L2_MULTI_MAX_SWITCHES:
+        return None
+    if os.path.isdir(POX_DIR) and POX_DIR not in sys.path:
+        sys.path.insert(0, POX_DIR)
+    try:
+        from pox.forwarding import l2_multi
+    except Exception as e:
+        # POX (python 2) is not available
+        print("Skipping l2_multi, POX can't be imported: %s" % e, file=sys.stderr)
+        return None
+    l2_multi.switches.clear()
+    l2_multi.adjacency.clear()
+    for dpid, links in topology.items():
+        l2_multi.switches[dpid] = dpid
+        for neighbor, port in links:
+            l2_multi.adjacency[dpid][neighbor] = port
+    with measure:
+        measure.time(l2_multi._calc_paths)
+        for src, dst in edge_pairs(edges):
+            measure.time(l2_multi._get_raw_path, src, dst)
+    return measure
+
+
+CASES = [
+    ('update', bench_update),
+    ('get_path', bench_get_path),
+    ('link_failure', bench_link_failure),
+    ('link_failure_per_flow', bench_link_failure_per_flow),
+    ('l2_multi', bench_l2_multi),
+]
+
+
+def run(specs):
+    results = {}
+    for spec in specs:
+        topology, edges = build_topology(spec)
+        for name, case in CASES:
+            measure = case(topology, edges, Measure())
+            if measure is None:
+                continue
+            memory = case(topology, edges, Measure(track_memory=True))
+            results["%s/%s" % (spec, name)] = measure.result(memory.peak_memory)
+    return results
+
+
+def report(results, baselines):
+    print("%-28s %8s %12s %10s %10s %12s %10s" %
+          ("case", "ops", "ops/sec", "p50 ms", "p99 ms", "peak KB", "vs base"))
+    for name in sorted(results):
+        result = results[name]
+        comparison = ""
+        if name in baselines and baselines[name]['ops_per_sec']:
+            comparison = "%.2fx" % (result['ops_per_sec'] / baselines[name]['ops_per_sec'])
+        print("%-28s %8d %12.1f %10.4f %10.4f %12d %10s" %
+              (name, result['ops'], result['ops_per_sec'], result['p50_ms'],
+               result['p99_ms'], result['peak_memory_kb'], comparison))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="ECMP path computation benchmark")
+    parser.add_argument("--topology", default=DEFAULT_TOPOLOGIES,
+                        help="comma separated topologies, e.g. fat_tree:4,leaf_spine:4:8,levels:3")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    results = run(args.topology.split(","))
+    report(results, baselines)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,28 +2,73 @@ from pox.core import core
 import pox.openflow.discovery
 import pox.openflow.spanning_tree
 import pox.forwarding.l2_learning
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
 from extensions.switch import SwitchController
 import pox.openflow.libopenflow_01 as of
 from pox.lib.addresses import EthAddr, IPAddr
 from pox.host_tracker.host_tracker import host_tracker
-from extensions.ecmp_utils import ECMPUtil
-import datetime as dt
+from extensions.ecmp_utils import ECMPUtil, flow_hash
+from extensions.link_stats import LinkStats
+from extensions.topology_store import TopologyStore
+from extensions.hot_log import HotLog
+from extensions.latency_stats import LatencyStats
+from extensions.elephant_flows import ElephantFlows
+from pox.lib.recoco import Timer
+from collections import OrderedDict
+import time
 from extensions.firewall import Firewall
 
 
 log = core.getLogger()
+hot_log = HotLog(log)
+
+# Segundos que un flujo o un grupo de send_barriers espera sus barriers antes de
+# seguir igual, por si se pierde una respuesta
+PENDING_FLOW_TIMEOUT = 2
 
 class Controller:
-  def __init__ (self):
-    self.connections = set()
-    self.switches = []
-    self.topology = {}
+  def __init__ (self, per_flow_ecmp = False, hash_seed = 0, link_stats = False, latency_interval = 0,
+                elephant_threshold = 0, firewall = False):
+    # Switches, enlaces y version de la topologia
+    self.store = TopologyStore()
     self.links_counter = 0
     self.host_tracker = host_tracker()
     self.hosts_by_switch = {}
-    self.ecmp_util = ECMPUtil()
+    # Carga medida (bytes/seg) de cada enlace (switch, vecino), la usa ECMPUtil para elegir caminos
+    self.link_loads = {}
+    self.ecmp_util = ECMPUtil(self.link_loads)
     self.has_updated_ecmp = False
+    # Claves de los flujos instalados por cada camino (switch_origen, switch_destino[, flow_hash]),
+    # con el puerto del host destino de cada uno
+    self.flows_by_path = {}
+    # SwitchController de los switches desconectados, por dpid
+    self.disconnected_switches = {}
+    # Clave del camino en flows_by_path de cada flujo instalado
+    self.path_by_flow = {}
+    # Metricas de la recuperacion ante la caida de enlaces (en segundos)
+    self.failover_metrics = {'recoveries': 0, 'rerouted_flows': 0, 'last_latency': None, 'max_latency': 0}
+    # En modo por flujo los paquetes IP se reparten entre los caminos de igual costo
+    # segun un hash de su 5-tupla. La semilla hace que el reparto sea deterministico.
+    self.per_flow_ecmp = per_flow_ecmp
+    self.hash_seed = hash_seed
+    self.use_link_stats = link_stats
+    self.link_stats = None
+    # Flujos cuyo camino se esta instalando: clave del flujo -> barriers que faltan y paquetes en espera
+    self.pending_flows = {}
+    # (dpid, xid) de cada barrier enviado -> clave del flujo que espera su respuesta
+    self.pending_barriers = {}
+    # (dpid, xid) de cada barrier enviado por send_barriers -> grupo de barriers y funcion a llamar
+    # cuando llegan todas sus respuestas
+    self.barrier_callbacks = {}
+    # Latencia de cada etapa de la instalacion de los flujos, desde que llega el PacketIn
+    self.latency = LatencyStats()
+    self.latency_interval = latency_interval
+    # Los flujos que superan este umbral (bytes/seg) se mueven al camino menos cargado, 0 lo desactiva
+    self.elephant_threshold = elephant_threshold
+    self.elephant_flows = None
+    # El firewall bloquea los destinos de los floods UDP que mide en las entradas por flujo
+    self.use_firewall = firewall
+    self.firewall = None
 
     # Esperando que los modulos openflow y openflow_discovery esten listos
     core.call_when_ready(self.startup, ('openflow', 'openflow_discovery'))
@@ -36,6 +81,18 @@ class Controller:
     """
     core.openflow.addListeners(self)
     core.openflow_discovery.addListeners(self)
+    # Las tablas de los switches que se reconectan no se borran, se reconcilian con
+    # reconcile. Las de los switches nuevos se borran en _handle_ConnectionUp.
+    core.openflow.clear_flows_on_connect = False
+    if self.use_link_stats:
+      self.link_stats = LinkStats(self.store, self.link_loads)
+    if self.elephant_threshold:
+      self.elephant_flows = ElephantFlows(self, threshold = self.elephant_threshold)
+    if self.use_firewall:
+      self.firewall = Firewall(self.host_tracker)
+    if self.latency_interval:
+      Timer(self.latency_interval, self.dump_latency, recurring=True)
+    Timer(PENDING_FLOW_TIMEOUT, self.expire_pending_flows, recurring=True)
     log.info('Controller initialized')
 
   def _handle_ConnectionUp(self, event):
@@ -43,14 +100,25 @@ class Controller:
       Esta funcion es llamada cada vez que un nuevo switch establece conexion
       Se encarga de crear un nuevo switch controller para manejar los eventos de cada switch
       """
-      if (event.dpid not in self.connections):
+      sw = self.store.get_switch(event.dpid)
+      if sw is not None:
+          # El switch se reconecto antes de que se cerrara la conexion vieja
+          log.info("Switch %s has reconnected.", dpid_to_str(event.dpid))
+          sw.set_connection(event.connection)
+          sw.reconcile()
+          return
+      sw = self.disconnected_switches.pop(event.dpid, None)
+      if sw is None:
           log.info("Switch %s has come up.", dpid_to_str(event.dpid))
-          self.connections.add(event.dpid)
-          self.topology[event.dpid] = set()
+          # No se sabe que instalo en el switch otro controller o una ejecucion anterior
+          event.connection.send(of.ofp_flow_mod(match=of.ofp_match(), command=of.OFPFC_DELETE))
           sw = SwitchController(event.dpid, event.connection, self)
-          self.switches.append(sw)
-          self.has_updated_ecmp = False
-          self.clean_switches_table()
+      else:
+          # Se reutiliza el SwitchController y su flow_table se reconcilia con la tabla del switch
+          log.info("Switch %s has come back up.", dpid_to_str(event.dpid))
+          sw.set_connection(event.connection)
+          sw.reconcile()
+      self.store.add_switch(event.dpid, sw)
 
 
   def _handle_LinkEvent(self, event):
@@ -62,75 +130,425 @@ class Controller:
       log.info("The discovered link is the %dth link"%self.links_counter)
 
       if event.added:
-          if (link.dpid2, link.port1) in self.topology[link.dpid1]:
+          if not self.store.has_switch(link.dpid1) or not self.store.has_switch(link.dpid2):
+              log.info("Ignoring added link between switches that are not connected")
+              return
+          if not self.store.add_link(link.dpid1, link.port1, link.dpid2):
               log.info("Ignoring added link because is already in the topology")
               return
           else:
               self.links_counter += 1
-              self.topology[link.dpid1].add((link.dpid2, link.port1))
+              if self.has_updated_ecmp:
+                  self.ecmp_util.add_link(link.dpid1, link.dpid2, link.port1)
 
       if event.removed:
-          if (link.dpid2, link.port1) not in self.topology[link.dpid1]:
+          if not self.store.remove_link(link.dpid1, link.port1, link.dpid2):
               log.info("Ignoring removed link because it doesnt belong to the topology")
               return
           else:
               self.links_counter -= 1
-              self.topology[link.dpid1].remove((link.dpid2, link.port1))
+              if self.has_updated_ecmp:
+                  self.invalidate_paths(self.ecmp_util.remove_link(link.dpid1, link.dpid2))
 
-      self.clean_switches_table()
       self.log_topology()
-      self.has_updated_ecmp = False
 
   def delete_switch(self, switch_dpid):
-      self.connections.remove(switch_dpid)
-      adjacencys = [edge[0] for edge in self.topology[switch_dpid]]
-      for adjacency in adjacencys:
-          edges_to_clean = self.topology[adjacency]
-          cleaned_egdes = set([edge for edge in edges_to_clean if switch_dpid not in edge])
-          self.topology[adjacency] = cleaned_egdes
-      del self.topology[switch_dpid]
-      self.has_updated_ecmp = False
-      self.clean_switches_table()
-
-  def ecmp_path(self, switch_origin, switch_destination):
+      """
+      Saca al switch caido de la topologia y mueve los caminos que lo usaban. Su
+      SwitchController se guarda para reutilizarlo si el switch vuelve.
+      """
+      sw = self.store.remove_switch(switch_dpid)
+      if sw is not None:
+          self.disconnected_switches[switch_dpid] = sw
+      if self.has_updated_ecmp:
+          self.invalidate_paths(self.ecmp_util.remove_switch(switch_dpid))
+      # Los paquetes en espera que llegaron por el switch caido ya no se pueden reenviar
+      for pending in self.pending_flows.values():
+          for packet_id in [packet_id for packet_id in pending['packets'] if packet_id[0] == switch_dpid]:
+              del pending['packets'][packet_id]
+      # Las barriers del switch caido no van a llegar
+      for barrier in [barrier for barrier in self.pending_barriers if barrier[0] == switch_dpid]:
+          self.barrier_received(*barrier)
+      for barrier in [barrier for barrier in self.barrier_callbacks if barrier[0] == switch_dpid]:
+          self.barrier_received(*barrier)
+
+  def invalidate_paths(self, invalidated_paths):
+      """
+      Mueve los flujos que usaban alguno de los caminos invalidados a un camino
+      de respaldo que no comparte enlaces con el viejo. Si no hay respaldo, borra
+      sus entradas de los switches y el proximo paquete de esos flujos vuelve a
+      pedir un camino. La latencia de recuperacion se mide hasta que todos los
+      switches confirman las entradas nuevas con su barrier.
+
+      :param invalidated_paths: diccionario (switch_origen, switch_destino[, flow_hash]) -> camino viejo
+      """
+      start = time.time()
+      rerouted_flows = 0
+      switches = set()
+      for path_key, old_path in invalidated_paths.items():
+          flows = self.flows_by_path.pop(path_key, {})
+          new_path = self.ecmp_util.use_backup(path_key, old_path) if flows else []
+          keep = set()
+          if new_path:
+              flow_hash = path_key[2] if len(path_key) > 2 else None
+              for key, destination_port in flows.items():
+                  switches.update(self.write_on_tables(new_path, key, destination_port, flow_hash))
+              rerouted_flows += len(flows)
+              keep = set(hop[0] for hop in new_path[:-1])
+              keep.add(new_path[-1])
+          else:
+              self.forget_flows(flows, path_key)
+          self.delete_flows(flows, old_path, keep)
+      if not rerouted_flows:
+          return
+
+      def recovered():
+          latency = time.time() - start
+          self.failover_metrics['recoveries'] += 1
+          self.failover_metrics['rerouted_flows'] += rerouted_flows
+          self.failover_metrics['last_latency'] = latency
+          self.failover_metrics['max_latency'] = max(latency, self.failover_metrics['max_latency'])
+          log.info("Rerouted %d flows to their backup paths in %.3f ms", rerouted_flows, latency * 1000)
+      self.send_barriers(switches, recovered)
+
+  def forget_evicted_paths(self):
+      """
+      Borra de los switches los flujos de los caminos que ECMPUtil saco de su
+      cache, asi ningun flujo instalado queda fuera del indice de enlaces. Los
+      caminos con flujos instalados no se sacan, asi que normalmente no hay ninguno.
+      """
+      for path_key, old_path in self.ecmp_util.pop_evicted().items():
+          flows = self.flows_by_path.pop(path_key, {})
+          self.forget_flows(flows, path_key)
+          self.delete_flows(flows, old_path)
+
+  def flow_removed(self, dpid, key):
+      """
+      Cuando expira la entrada del switch de ingreso de un flujo, el flujo deja de estar
+      asignado a su camino. Si el camino se queda sin flujos, ECMPUtil lo olvida y deja
+      de contarlo al elegir los caminos menos usados.
+      """
+      path_key = self.path_by_flow.get(key)
+      if path_key is None or path_key[0] != dpid:
+          return
+      del self.path_by_flow[key]
+      self.flows_by_path.get(path_key, {}).pop(key, None)
+      self.forget_unused_path(path_key)
+
+  def forget_unused_path(self, path_key):
+      """Si el camino se quedo sin flujos, ECMPUtil lo olvida"""
+      if self.flows_by_path.get(path_key):
+          return
+      self.flows_by_path.pop(path_key, None)
+      if self.has_updated_ecmp and path_key in self.ecmp_util.paths:
+          self.ecmp_util.forget_path(path_key)
+
+  def forget_flows(self, flows, path_key):
+      """Olvida el camino de los flujos que se borran de los switches"""
+      for key in flows:
+          if self.path_by_flow.get(key) == path_key:
+              del self.path_by_flow[key]
+
+  def delete_flows(self, flows, old_path, keep=()):
+      """Borra las entradas de los flujos en los switches del camino, salvo en los de keep"""
+      for dpid in old_path:
+          switch_controller = self.get_switch_by_dpid(dpid)
+          if switch_controller is None or dpid in keep:
+              continue
+          for key in flows:
+              switch_controller.delete_entry(key)
+
+  def flow_hash(self, key):
+    """Hash deterministico de la 5-tupla de un flujo"""
+    return flow_hash(key, self.hash_seed)
+
+  def ecmp_path(self, switch_origin, switch_destination, flow_hash=None):
     if not self.has_updated_ecmp:
-        log.info("Updating topology")
-        log.info(dt.datetime.now())
+        start = time.time()
         self.has_updated_ecmp = True
-        self.ecmp_util.update(self.topology)
-        log.info(dt.datetime.now())
-    log.info("Asking path to go from %s to %s"%(switch_origin, switch_destination))
-    return self.ecmp_util.get_path(switch_origin, switch_destination)
+        self.ecmp_util.update(self.store.snapshot())
+        log.info("Topology updated in %.3f ms", (time.time() - start) * 1000)
+    hot_log.info("Asking path to go from %s to %s", switch_origin, switch_destination)
+    path = self.ecmp_util.get_path(switch_origin, switch_destination, flow_hash)
+    self.forget_evicted_paths()
+    return path
 
   def log_topology(self):
     log.info("The resultant topology after the discovery is: ")
-    for switch, adjacents in self.topology.items():
+    for switch, adjacents in self.store.topology.items():
         log.info('switch: ' + str(switch) + ' have this adjacents: ' + str(list(adjacents)))
 
 
-  def write_on_tables(self, path, source_mac_address, destination_mac_address):
-    for i in range(0, len(path) - 1):
-      print("path", path)
-      dpid_switch = path[i][0]
-      next_hop = path[i][1]
+  def write_on_tables(self, path, key, destination_port=None, flow_hash=None):
+    """
+    Instala las entradas del flujo en todos los switches del camino, de forma
+    que solo el primer paquete del flujo llegue al controller.
+    Si se conoce el puerto del host destino, tambien se instala la entrada
+    del ultimo switch.
+    """
+    hot_log.info("Installing flow %s on path %s", key, path)
+    hops = [(hop[0], hop[1]) for hop in path[:-1]]
+    if destination_port is not None and path:
+      hops.append((path[-1], destination_port))
+    if path:
+      path_key = (path[0][0], path[-1]) if flow_hash is None else (path[0][0], path[-1], flow_hash)
+      self.flows_by_path.setdefault(path_key, {})[key] = destination_port
+      self.path_by_flow[key] = path_key
+      # Mientras tenga flujos instalados, el camino no sale de la cache
+      self.ecmp_util.hold(path_key)
+    switches = []
+    for dpid_switch, next_hop in hops:
       switch_controller = self.get_switch_by_dpid(dpid_switch)
-      switch_controller.write_on_table((source_mac_address, destination_mac_address), next_hop)
+      if switch_controller is None:
+        continue
+      switch_controller.write_on_table(key, next_hop)
+      switches.append(switch_controller)
+    return switches
 
-  def get_switch_by_dpid(self, dpid):
-      for switch in self.switches:
-        if dpid == switch.get_dpid():
-            return switch
+  def wait_for_barriers(self, key, switches, switch_controller, event, start=None):
+    """
+    Envia un barrier a cada switch donde se escribio el flujo y deja el paquete
+    en espera hasta que lleguen todas las respuestas.
+    start es el momento en que llego el PacketIn que inicio la instalacion.
+    """
+    barriers = set()
+    for switch in switches:
+      barrier = of.ofp_barrier_request()
+      switch.connection.send(barrier)
+      barriers.add((switch.get_dpid(), barrier.xid))
+      self.pending_barriers[(switch.get_dpid(), barrier.xid)] = key
+    self.pending_flows[key] = {'barriers': barriers, 'packets': OrderedDict(), 'start': start,
+                               'created': time.time()}
+    self.queue_packet(key, switch_controller, event)
+    if not barriers:
+      self.release_packets(key)
+
+  def queue_packet(self, key, switch_controller, event):
+    """
+    Si se esta instalando el camino del flujo, deja el paquete en espera.
+    Los paquetes se identifican por (dpid, buffer_id) para no encolarlos dos veces.
 
-      log.info("Exception: Switch not founded.")
+    :return: True si el paquete quedo en espera
+    """
+    pending = self.pending_flows.get(key)
+    if pending is None:
+      return False
+    buffer_id = event.ofp.buffer_id if event.ofp.buffer_id is not None else id(event)
+    packet_id = (switch_controller.get_dpid(), buffer_id)
+    if packet_id not in pending['packets']:
+      pending['packets'][packet_id] = (switch_controller, event)
+    return True
+
+  def send_barriers(self, switches, callback):
+    """
+    Envia un barrier a cada switch y llama a callback cuando todos responden,
+    es decir, cuando ya aplicaron todos los mensajes enviados antes. Si alguna
+    respuesta no llega en PENDING_FLOW_TIMEOUT, callback se llama igual.
+    """
+    group = {'barriers': set(), 'callback': callback, 'created': time.time()}
+    for switch in switches:
+      barrier = of.ofp_barrier_request()
+      switch.connection.send(barrier)
+      group['barriers'].add((switch.get_dpid(), barrier.xid))
+      self.barrier_callbacks[(switch.get_dpid(), barrier.xid)] = group
+    if not group['barriers']:
+      callback()
+
+  def barrier_received(self, dpid, xid):
+    group = self.barrier_callbacks.pop((dpid, xid), None)
+    if group is not None:
+      group['barriers'].discard((dpid, xid))
+      if not group['barriers']:
+        group['callback']()
+      return
+    key = self.pending_barriers.pop((dpid, xid), None)
+    if key is None:
+      return
+    pending = self.pending_flows.get(key)
+    if pending is None:
+      return
+    pending['barriers'].discard((dpid, xid))
+    if not pending['barriers']:
+      self.release_packets(key)
+
+  def expire_pending_flows(self):
+    """
+    Libera los paquetes de los flujos, y llama a las funciones de los grupos de
+    send_barriers, que esperan sus barriers hace mas de PENDING_FLOW_TIMEOUT,
+    asi un barrier perdido no los deja en espera para siempre
+    """
+    now = time.time()
+    # Cada grupo esta una vez por cada uno de sus barriers
+    groups = dict((id(group), group) for group in self.barrier_callbacks.values()
+                  if now - group['created'] > PENDING_FLOW_TIMEOUT)
+    for group in groups.values():
+      for barrier in group['barriers']:
+        self.barrier_callbacks.pop(barrier, None)
+      log.info("Barriers %s timed out", sorted(group['barriers']))
+      group['barriers'].clear()
+      group['callback']()
+    expired = [key for key, pending in self.pending_flows.items()
+               if now - pending['created'] > PENDING_FLOW_TIMEOUT]
+    for key in expired:
+      for barrier in self.pending_flows[key]['barriers']:
+        self.pending_barriers.pop(barrier, None)
+      log.info("Flow %s timed out waiting for its barriers", key)
+      self.release_packets(key)
+
+  def release_packets(self, key):
+    """Reenvia los paquetes en espera del flujo segun las entradas ya instaladas"""
+    pending = self.pending_flows.pop(key)
+    for switch_controller, event in pending['packets'].values():
+      next_hop = switch_controller.get_next_hop(key)
+      if next_hop:
+        switch_controller.forward(next_hop, event)
+      else:
+        switch_controller.drop(event)
+    if pending['start'] is not None:
+      self.latency.record('setup', time.time() - pending['start'])
+
+  def reroute_flow(self, key):
+    """
+    Mueve un flujo instalado al camino de igual costo menos cargado, sin perder paquetes
+    (make-before-break):
+    1. Instala el flujo en los switches que solo estan en el camino nuevo
+    2. Cuando confirman, cambia la salida de los switches de ambos caminos, incluido el de ingreso
+    3. Cuando confirman, borra el flujo de los switches que solo estaban en el camino viejo
+    El camino queda fijado para el flujo con la clave (switch_origen, switch_destino, clave_del_flujo).
+
+    :return: True si el flujo se esta moviendo a otro camino
+    """
+    path_key = self.path_by_flow.get(key)
+    flows = self.flows_by_path.get(path_key, {})
+    if key not in flows or path_key not in self.ecmp_util.paths:
+      return False
+    old_path = self.ecmp_util.paths[path_key]
+    new_path = self.ecmp_util.shortest_path(old_path[0], old_path[-1])
+    if not new_path or new_path == old_path:
+      return False
+
+    destination_port = flows.pop(key)
+    self.forget_unused_path(path_key)
+    old_hops = dict(self.ecmp_util.hops(old_path)[:-1])
+    new_key = (old_path[0], old_path[-1], key)
+    new_hops = dict(self.ecmp_util.pin_path(new_key, new_path)[:-1])
+    self.forget_evicted_paths()
+    if destination_port is not None:
+      old_hops[old_path[-1]] = new_hops[new_path[-1]] = destination_port
+    self.flows_by_path.setdefault(new_key, {})[key] = destination_port
+    self.path_by_flow[key] = new_key
+    self.ecmp_util.hold(new_key)
+
+    added = [dpid for dpid in reversed(new_path) if dpid in new_hops and dpid not in old_hops]
+    changed = [dpid for dpid in reversed(new_path) if dpid in old_hops and dpid in new_hops
+               and old_hops[dpid] != new_hops[dpid]]
+    removed = [dpid for dpid in old_path if dpid in old_hops and dpid not in new_hops]
+
+    def remove_old_entries():
+      for dpid in removed:
+        switch_controller = self.get_switch_by_dpid(dpid)
+        if switch_controller is not None:
+          switch_controller.delete_entry(key)
+
+    def switch_over():
+      self.send_barriers(self.install_flow(key, new_hops, changed), remove_old_entries)
+
+    self.send_barriers(self.install_flow(key, new_hops, added), switch_over)
+    return True
+
+  def expected_next_hop(self, dpid, key):
+    """
+    Devuelve la salida que deberia tener el flujo en el switch segun el camino que tiene
+    asignado, o None si el camino del flujo no pasa por el switch
+    """
+    path_key = self.path_by_flow.get(key)
+    if not self.has_updated_ecmp or path_key not in self.ecmp_util.paths:
+      return None
+    if key not in self.flows_by_path.get(path_key, {}):
+      return None
+    path = self.ecmp_util.paths[path_key]
+    if dpid == path[-1]:
+      return self.flows_by_path[path_key][key]
+    if dpid not in path:
+      return None
+    return self.ecmp_util.ports.get((dpid, path[path.index(dpid) + 1]))
+
+  def install_flow(self, key, hops, dpids):
+    """
+    Escribe la entrada del flujo en cada switch de dpids, con la salida que indica hops
+
+    :return: los SwitchController donde se escribio
+    """
+    switches = []
+    for dpid in dpids:
+      switch_controller = self.get_switch_by_dpid(dpid)
+      if switch_controller is not None:
+        switch_controller.write_on_table(key, hops[dpid])
+        switches.append(switch_controller)
+    return switches
+
+  def get_switch_by_dpid(self, dpid):
+      switch = self.store.get_switch(dpid)
+      if switch is None:
+          log.info("Exception: Switch not founded.")
+      return switch
 
   def clean_switches_table(self):
-      for swicht in self.switches:
+      for swicht in self.store.get_switches():
           swicht.clean_table()
 
-def launch():
+  def dump_latency(self):
+      """
+      Loguea la latencia (p50, p99 y maximo) de cada etapa de la instalacion de flujos.
+      Se puede llamar en cualquier momento, por ejemplo desde la consola py de pox.
+      """
+      log.info("Flow setup latency by stage:")
+      self.latency.log_summary(log)
+
+  def set_hot_logging(self, enabled = None, sample = None, rate = None):
+      """
+      Cambia en ejecucion los logs de lo que se ejecuta por cada paquete, por ejemplo desde
+      la consola py de pox: core.Controller.set_hot_logging(sample = 100)
+
+      :param enabled: False los apaga
+      :param sample: se considera uno de cada sample llamados
+      :param rate: maximo de mensajes por segundo de cada linea
+      """
+      HotLog.configure(enabled = enabled, sample = sample, rate = rate)
+
+def launch(per_flow = False, hash_seed = 0, link_stats = False, hot_log = True,
+           hot_log_sample = 1, hot_log_rate = 10, latency_interval = 0, elephant_threshold = 0,
+           firewall = False):
+  """
+  --per_flow reparte cada flujo TCP/UDP por un camino segun el hash de su 5-tupla
+  --hash_seed=<n> cambia la semilla del hash
+  --link_stats elige los caminos nuevos segun la carga medida de cada enlace
+  --hot_log=False apaga los logs que se escriben por cada paquete
+  --hot_log_sample=<n> escribe uno de cada n de esos logs
+  --hot_log_rate=<n> maximo de esos logs por segundo en cada linea
+  --latency_interval=<segundos> loguea periodicamente la latencia de cada etapa de la instalacion de flujos
+  --elephant_threshold=<bytes/seg> mueve los flujos que lo superan al camino de igual costo menos cargado
+  --firewall bloquea los floods UDP. Mide el trafico con las entradas por flujo, asi que activa --per_flow
+  """
+  HotLog.configure(enabled = str_to_bool(hot_log), sample = int(hot_log_sample),
+                   rate = float(hot_log_rate))
   # Inicializando el modulo openflow_discovery
   pox.openflow.discovery.launch()
 
   # Registrando el Controller en pox.core para que sea ejecutado
-  core.registerNew(Controller)
-  # core.registerNew(Firewall)
+  # Sin entradas por flujo no hay contadores de trafico UDP para el firewall
+  firewall = str_to_bool(firewall)
+  core.registerNew(Controller, per_flow_ecmp = str_to_bool(per_flow) or firewall,
+                   hash_seed = int(hash_seed), link_stats = str_to_bool(link_stats),
+                   latency_interval = float(latency_interval),
+                   elephant_threshold = float(elephant_threshold), firewall = firewall)
+  core.call_when_ready(refuse_workers, 'of_01')
+
+def refuse_workers():
+  """
+  El controller necesita ver todos los switches para instalar los caminos, asi que
+  no puede correr repartido en varios procesos (openflow.of_01 --workers)
+  """
+  if getattr(core.of_01, 'shards', None) is not None:
+    log.error("The controller needs every switch in a single process, run it without --workers")
+    core.quit()
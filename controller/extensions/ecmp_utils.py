@@ -1,98 +1,310 @@
+from collections import OrderedDict
 import random
 import time
+import zlib
+
+# Granularity in bytes/sec used to compare the load of two links, so that
+# similar loaded links are still chosen by their use counts
+LOAD_STEP = 125000
+# Maximum amount of paths kept, the least recently used ones without flows
+# installed are evicted
+MAX_PATHS = 10000
+
+
+def flow_hash(key, seed=0):
+    """
+    Deterministic hash of the 5-tuple of a per flow key, (dl_src, dl_dst,
+    nw_proto, nw_src, nw_dst, tp_src, tp_dst). The seed changes how the
+    flows are spread over the paths.
+    """
+    return zlib.crc32(("%s:%s" % (seed, key[2:])).encode()) & 0xffffffff
 
 
 class ECMPUtil():
     """
     links: a dictionary of sets with the links
+    reverse_links: a dictionary of sets with the incoming links of each vertice
     use_counts: a dictionary of edges and it use count
-    paths: a dictionary of paths
+    paths: a dictionary of paths by (start, end) or (start, end, flow_hash)
+    held: a set with the keys of the paths that have flows installed, they are
+          never evicted
+    idle: an ordered dictionary (least recently used first) with the keys of the
+          paths that are not held, the candidates to be evicted
+    paths_by_link: a dictionary of edges and the keys of the paths that use it
+    keys_by_pair: a dictionary (start, end) -> amount of assigned paths between them
+    backups: a dictionary (start, end) -> link-disjoint backup path, or None if there
+             is none, computed once for each pair with assigned paths
+    backups_by_link: a dictionary of edges and the pairs whose backup uses it
     ports: a dictionary with a port for each edge
+    dags: a dictionary with the shortest path DAG towards each destination
+    link_loads: a dictionary of edges and its measured bytes/sec
+    evicted: a dictionary with the paths evicted since the last pop_evicted
     """
-    def __init__(self):
+    def __init__(self, link_loads=None, max_paths=MAX_PATHS):
+        self.link_loads = link_loads if link_loads is not None else {}
+        self.max_paths = max_paths
         self.links = None
+        self.reverse_links = None
         self.use_counts = None
         self.paths = None
+        self.held = None
+        self.idle = None
         self.ports = None
+        self.dags = None
+        self.paths_by_link = None
+        self.keys_by_pair = None
+        self.backups = None
+        self.backups_by_link = None
+        self.evicted = {}
 
     @staticmethod
-    def bfs_path_recursive(start, end, links, use_counts, previous, parents, visited):
-        """
-        Its our recursive strategy for BFS with a greedy optimization for each step
-
-        :param start: the start vertice of this recursive iteration
-        :param end: the target end
-        :param links: the links dictionary
-        :param use_counts: the use counts dictionary for each edge tuple
-        :param previous: the vertice from the previous iteration
-        :param parents: the parents dictionary that tracks the path
-        :param visited: a visited set
-        :return: a parents dictionary
-        """
-        parents[start] = previous
-        visited.update([previous])
-        # We have found our target:
-        if start == end:
-            return parents
-        # Our target is not reacheable:
-        if start not in links:
+    def bfs_dag(end, reverse_links):
+        """
+        BFS from the end vertice over the reversed edges. Every vertice gets all
+        of its equal cost next hops, that is, the neighbors that are one step
+        closer to the end.
+
+        :param end: the target vertice
+        :param reverse_links: the dictionary of sets containing the incoming edges
+        :return: a tuple with the distances to end and a dictionary with a list
+                 of next hops for each vertice that can reach end
+        """
+        distances = {end: 0}
+        next_hops = {end: []}
+        layer = [end]
+        while layer:
+            next_layer = []
+            for vertice in layer:
+                distance = distances[vertice] + 1
+                for previous in reverse_links.get(vertice, ()):
+                    if previous not in distances:
+                        distances[previous] = distance
+                        next_hops[previous] = [vertice]
+                        next_layer.append(previous)
+                    elif distances[previous] == distance:
+                        next_hops[previous].append(vertice)
+            layer = next_layer
+        return distances, next_hops
+
+    def get_dag(self, end):
+        """
+        Returns the shortest path DAG towards end. It is built the first time a
+        path to end is asked and kept until a topology change affects it.
+        """
+        if end not in self.dags:
+            self.dags[end] = ECMPUtil.bfs_dag(end, self.reverse_links)
+        return self.dags[end][1]
+
+    def shortest_path(self, start, end):
+        """
+        Walks the DAG from start to end choosing on each step the least loaded
+        next hop, then the least used (ties are broken randomly)
+
+        :param start: the start vertice
+        :param end: the target vertice
+        :return: a list as a path, containing the start and end, or None
+        """
+        dag = self.get_dag(end)
+        if start not in dag or start == end:
             return None
-        # We now use a greedy strategy to iterate the neighbors using the least used first
-        # Is not our goal to minimize the total used cost,
-        # just the local on each step because we want the optimal length also,
-        # and dijkstra (global cost) cant guarantee us that
-        neighbors = [(link, use_counts[(start, link)]) for link in links[start]]
-        random.shuffle(neighbors)
-        neighbors = [n[0] for n in sorted(neighbors, key=lambda x: x[1])]
-        for neigh in neighbors:
-            # Tipical if for BFS to avoid loops
-            if neigh in visited:
-                continue
-            # We get the parents of this step, could be None
-            _parents = ECMPUtil.bfs_path_recursive(neigh, end, links, use_counts, start, parents.copy(), visited.copy())
-            if _parents:
-                return _parents
+        path = [start]
+        actual = start
+        while actual != end:
+            costs = [(self.edge_cost(actual, hop), hop) for hop in dag[actual]]
+            least_cost = min(cost for cost, _ in costs)
+            actual = random.choice([hop for cost, hop in costs if cost == least_cost])
+            path.append(actual)
+        return path
 
-    @staticmethod
-    def bfs_path(start, end, links, use_counts):
+    def edge_cost(self, origin, end):
+        """
+        The cost of an edge for the next hop selection, its load and then its use count
         """
-        Recursive BFS with a greedy strategy while prioritizing the next hop
+        edge = (origin, end)
+        return (int(self.link_loads.get(edge, 0) // LOAD_STEP), self.use_counts[edge])
+
+    def hashed_path(self, start, end, flow_hash):
+        """
+        Walks the DAG from start to end choosing on each step the next hop given
+        by the flow hash, so the same flow always takes the same path and
+        different flows are spread over all the equal cost paths
 
         :param start: the start vertice
         :param end: the target vertice
-        :param links: the dictionary of sets containing the edges
-        :param use_counts: the use counts dictionary for each edge tuple
-        :return: a list as a path, containing the start and end
+        :param flow_hash: an integer hash of the flow
+        :return: a list as a path, containing the start and end, or None
         """
-        random.seed(time.time())
-        parents = {}
-        visited = set()
-        neighbors = [(link, use_counts[(start, link)]) for link in links[start]]
-        random.shuffle(neighbors)
-        neighbors = [n[0] for n in sorted(neighbors, key=lambda x: x[1])]
-        visited.update([start])
-        for neigh in neighbors:
-            _parents = ECMPUtil.bfs_path_recursive(neigh, end, links, use_counts, start, parents.copy(), visited.copy())
-            if _parents:
-                path = []
-                actual = end
-                while True:
-                    path.append(_parents[actual])
-                    actual = _parents[actual]
-                    if actual not in _parents:
-                        return list(reversed(path)) + [end]
-
-    def get_path(self, start, end):
-        if (start, end) not in self.paths:
-            path = ECMPUtil.bfs_path(start, end, self.links, self.use_counts)
-            if path:
-                self.paths[(start, end)] = path
-                # We update the use counts
-                for i in range(len(path)-1):
-                    self.use_counts[(path[i], path[i+1])] += 1
-            else:
-                return []
-        path = self.paths[(start, end)]
+        dag = self.get_dag(end)
+        if start not in dag or start == end:
+            return None
+        path = [start]
+        actual = start
+        while actual != end:
+            next_hops = sorted(dag[actual])
+            # The hash is mixed with the vertice to avoid every hop taking the same choice
+            index = zlib.crc32(("%s:%s" % (flow_hash, actual)).encode()) & 0xffffffff
+            actual = next_hops[index % len(next_hops)]
+            path.append(actual)
+        return path
+
+    def disjoint_path(self, start, end, path):
+        """
+        BFS for the shortest path from start to end that shares no link with
+        the given path, in any direction
+
+        :return: a list as a path, containing the start and end, or None
+        """
+        excluded = set()
+        for i in range(len(path)-1):
+            excluded.update([(path[i], path[i+1]), (path[i+1], path[i])])
+        parents = {start: None}
+        layer = [start]
+        while layer and end not in parents:
+            next_layer = []
+            for vertice in layer:
+                for neigh in self.links.get(vertice, ()):
+                    if neigh not in parents and (vertice, neigh) not in excluded:
+                        parents[neigh] = vertice
+                        next_layer.append(neigh)
+            layer = next_layer
+        if end not in parents:
+            return None
+        backup = [end]
+        while parents[backup[-1]] is not None:
+            backup.append(parents[backup[-1]])
+        return list(reversed(backup))
+
+    @staticmethod
+    def index_path(index, key, path):
+        for i in range(len(path)-1):
+            index.setdefault((path[i], path[i+1]), set()).add(key)
+
+    @staticmethod
+    def unindex_path(index, key, path):
+        for i in range(len(path)-1):
+            keys = index.get((path[i], path[i+1]))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[(path[i], path[i+1])]
+
+    def assign_path(self, key, path):
+        """
+        Assigns the path to the key, updating the use counts. The first path
+        of a (start, end) pair also gets the backup of the pair.
+        If there are too many paths, the least recently used one that is not
+        held is evicted.
+        """
+        self.paths[key] = path
+        pair = (path[0], path[-1])
+        self.keys_by_pair[pair] = self.keys_by_pair.get(pair, 0) + 1
+        if pair not in self.backups:
+            self.set_backup(pair, self.disjoint_path(path[0], path[-1], path))
+        if key not in self.held:
+            self.idle.pop(key, None)
+            self.idle[key] = None
+        ECMPUtil.index_path(self.paths_by_link, key, path)
+        # We update the use counts
+        for i in range(len(path)-1):
+            self.use_counts[(path[i], path[i+1])] += 1
+        while len(self.paths) > self.max_paths and self.idle:
+            oldest = next(iter(self.idle))
+            if oldest == key:
+                break
+            self.evicted[oldest] = self.forget_path(oldest)
+
+    def pin_path(self, key, path):
+        """
+        Assigns the given path to the key, replacing the one it had. Used to
+        move a flow to a path that was not chosen by get_path.
+
+        :param path: a list of vertices, containing the start and end
+        :return: the path as returned by get_path
+        """
+        if key in self.paths:
+            self.forget_path(key, keep_backup=True)
+        self.assign_path(key, path)
+        return self.hops(path)
+
+    def set_backup(self, pair, backup):
+        self.drop_backup(pair)
+        self.backups[pair] = backup
+        if backup:
+            ECMPUtil.index_path(self.backups_by_link, pair, backup)
+
+    def drop_backup(self, pair):
+        backup = self.backups.pop(pair, None)
+        if backup:
+            ECMPUtil.unindex_path(self.backups_by_link, pair, backup)
+
+    def hold(self, key):
+        """
+        Marks the path of the key as used by installed flows, so it is not
+        evicted until it is forgotten
+        """
+        if key in self.paths:
+            self.held.add(key)
+            self.idle.pop(key, None)
+
+    def pop_evicted(self):
+        """
+        Returns the paths evicted from the cache since the last call, so the
+        caller can forget whatever it installed for them
+
+        :return: a dictionary with the evicted paths by key
+        """
+        evicted = self.evicted
+        self.evicted = {}
+        return evicted
+
+    def get_path(self, start, end, flow_hash=None):
+        """
+        Returns the path from start to end as a list of (switch, port) hops
+        followed by end. When flow_hash is given, the path is chosen per flow.
+        """
+        key = (start, end) if flow_hash is None else (start, end, flow_hash)
+        if key in self.paths:
+            if key in self.idle:
+                # We move the path to the end, as the most recently used
+                del self.idle[key]
+                self.idle[key] = None
+            return self.hops(self.paths[key])
+        if flow_hash is None:
+            path = self.shortest_path(start, end)
+        else:
+            path = self.hashed_path(start, end, flow_hash)
+        if not path:
+            return []
+        self.assign_path(key, path)
+        return self.hops(path)
+
+    def use_backup(self, key, old_path):
+        """
+        Replaces an invalidated path by the backup of its (start, end) pair.
+        Every path of the pair shares the same backup, it is only searched
+        again when the pair has none, so the flows of a pair failing over
+        together cost a single BFS.
+
+        :param key: the (start, end) or (start, end, flow_hash) key of the path
+        :param old_path: the invalidated path, a list of vertices
+        :return: the new path as returned by get_path, or an empty list
+        """
+        if key in self.paths:
+            return []
+        pair = (old_path[0], old_path[-1])
+        if pair not in self.backups:
+            self.set_backup(pair, self.disjoint_path(pair[0], pair[1], old_path))
+        backup = self.backups[pair]
+        if not backup:
+            return []
+        self.assign_path(key, backup)
+        return self.hops(backup)
+
+    def hops(self, path):
+        """
+        Converts a path into a list of (switch, port) hops followed by the end
+        """
+        end = path[-1]
         new_path = []
         for i in range(len(path)-1):
             new_path.append((path[i], self.ports[(path[i], path[i+1])]))
@@ -104,10 +316,104 @@ class ECMPUtil():
 
         :param topology: a dictionary of sets with tuple (switch, port)
         """
-        vertices = ([sw for sw in topology.keys()] +
-                    [edge[0] for edges in topology.values() for edge in edges])
-        vertices = list(set(vertices))
+        random.seed(time.time())
         self.ports = {(sw, edge[0]): edge[1] for sw, edges in topology.items() for edge in edges}
         self.links = {sw: set(map(lambda x: x[0], edges)) for sw, edges in topology.items()}
+        self.reverse_links = {}
+        for origin, ends in self.links.items():
+            for end in ends:
+                self.reverse_links.setdefault(end, set()).add(origin)
         self.use_counts = {(origin, end): 0 for origin in self.links.keys() for end in self.links[origin]}
         self.paths = {}
+        self.held = set()
+        self.idle = OrderedDict()
+        self.dags = {}
+        self.paths_by_link = {}
+        self.keys_by_pair = {}
+        self.backups = {}
+        self.backups_by_link = {}
+        self.evicted = {}
+
+    def add_link(self, origin, end, port):
+        """
+        Adds a link without recomputing the paths. The already assigned paths
+        are still valid, only the DAGs that get a new shorter or equal cost
+        next hop are discarded, and the pairs without backup search it again.
+
+        :return: a dictionary with the invalidated paths, always empty
+        """
+        self.links.setdefault(origin, set()).add(end)
+        self.reverse_links.setdefault(end, set()).add(origin)
+        self.ports[(origin, end)] = port
+        self.use_counts.setdefault((origin, end), 0)
+        for destination, (distances, _) in list(self.dags.items()):
+            if end not in distances:
+                continue
+            if origin not in distances or distances[origin] >= distances[end] + 1:
+                del self.dags[destination]
+        for pair in [pair for pair, backup in self.backups.items() if backup is None]:
+            del self.backups[pair]
+        return {}
+
+    def remove_link(self, origin, end):
+        """
+        Removes a link, invalidating only the paths, backups and DAGs that use it.
+        The pairs that lose their backup search a new one when they need it.
+
+        :return: a dictionary with the invalidated paths by (start, end)
+        """
+        self.links.get(origin, set()).discard(end)
+        self.reverse_links.get(end, set()).discard(origin)
+        self.ports.pop((origin, end), None)
+        for destination, (_, next_hops) in list(self.dags.items()):
+            if end in next_hops.get(origin, ()):
+                del self.dags[destination]
+        invalidated = {}
+        for pair in list(self.paths_by_link.get((origin, end), ())):
+            # The backup of the pair is kept, use_backup needs it
+            invalidated[pair] = self.forget_path(pair, keep_backup=True)
+        for pair in list(self.backups_by_link.get((origin, end), ())):
+            self.drop_backup(pair)
+        self.use_counts.pop((origin, end), None)
+        self.link_loads.pop((origin, end), None)
+        return invalidated
+
+    def remove_switch(self, switch):
+        """
+        Removes a switch and all of its links
+
+        :return: a dictionary with the invalidated paths by (start, end)
+        """
+        invalidated = {}
+        for end in list(self.links.get(switch, ())):
+            invalidated.update(self.remove_link(switch, end))
+        for origin in list(self.reverse_links.get(switch, ())):
+            invalidated.update(self.remove_link(origin, switch))
+        self.links.pop(switch, None)
+        self.reverse_links.pop(switch, None)
+        self.dags.pop(switch, None)
+        return invalidated
+
+    def forget_path(self, pair, keep_backup=False):
+        """
+        Forgets the path assigned to a (start, end) pair or flow, releasing its use counts.
+        The backup of the (start, end) pair is dropped with its last path,
+        unless keep_backup is given.
+
+        :return: the forgotten path
+        """
+        path = self.paths.pop(pair)
+        ends = (path[0], path[-1])
+        self.keys_by_pair[ends] -= 1
+        if not self.keys_by_pair[ends]:
+            del self.keys_by_pair[ends]
+            if not keep_backup:
+                self.drop_backup(ends)
+        self.held.discard(pair)
+        self.idle.pop(pair, None)
+        ECMPUtil.unindex_path(self.paths_by_link, pair, path)
+        for i in range(len(path)-1):
+            edge = (path[i], path[i+1])
+            if edge in self.use_counts:
+                self.use_counts[edge] -= 1
+        return path
@@ -0,0 +1,86 @@
+from pox.lib.recoco import Timer
+import pox.openflow.libopenflow_01 as of
+from pox.core import core
+from extensions.switch import flow_key, FLOW_COOKIE
+import time
+
+STATS_INTERVAL = 5
+# Flows that send more than this bytes/sec are elephants (10 Mbit/s)
+ELEPHANT_THRESHOLD = 1250000
+
+log = core.getLogger()
+
+class ElephantFlows:
+    """
+    Polls the flow statistics of every switch and moves the elephant flows,
+    the ones whose rate goes over the threshold, to the least loaded equal
+    cost path. Each flow is measured on the first switch of its path and
+    is only moved once, when it becomes an elephant. The mice flows keep
+    the path they were given.
+
+    counters: a dictionary (dpid, flow key) -> (byte_count, timestamp) of the last poll
+    elephants: a dictionary flow key -> bytes/sec of the flows already moved
+    requests: a dictionary dpid -> xid of the last flow stats request sent to it,
+              the replies to other modules' requests may hold only part of the table
+    """
+    def __init__(self, controller, interval=STATS_INTERVAL, threshold=ELEPHANT_THRESHOLD):
+        core.openflow.addListenerByName("FlowStatsReceived",
+                                        self.handle_flow_stats)
+        core.openflow.addListenerByName("ConnectionDown",
+                                        self.handle_connection_down)
+        Timer(interval, self.take_statistics, recurring=True)
+        self.controller = controller
+        self.threshold = threshold
+        self.counters = {}
+        self.elephants = {}
+        self.requests = {}
+        self.log = log
+
+    def take_statistics(self):
+        for connection in core.openflow.connections:
+            if connection.congested:
+                # The switch is not reading what it was already sent
+                continue
+            request = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+            self.requests[connection.dpid] = request.xid
+            connection.send(request)
+
+    def handle_flow_stats(self, event):
+        dpid = event.connection.dpid
+        if self.requests.get(dpid) != event.ofp[0].xid:
+            return
+        del self.requests[dpid]
+        now = time.time()
+        seen = set()
+        for stat in event.stats:
+            if stat.cookie != FLOW_COOKIE:
+                continue
+            key = flow_key(stat.match)
+            path_key = self.controller.path_by_flow.get(key)
+            if path_key is None or path_key[0] != dpid:
+                # Only the first switch of the path measures the flow
+                continue
+            seen.add(key)
+            previous = self.counters.get((dpid, key))
+            self.counters[(dpid, key)] = (stat.byte_count, now)
+            if previous is None or now <= previous[1] or stat.byte_count < previous[0]:
+                # First sample or the entry was installed again
+                continue
+            rate = (stat.byte_count - previous[0]) / (now - previous[1])
+            if rate < self.threshold:
+                self.elephants.pop(key, None)
+            elif key not in self.elephants:
+                self.elephants[key] = rate
+                if self.controller.reroute_flow(key):
+                    self.log.info("Elephant flow %s (%.0f bytes/sec) moved to the least loaded path",
+                                  key, rate)
+        for counter in [counter for counter in self.counters
+                        if counter[0] == dpid and counter[1] not in seen]:
+            del self.counters[counter]
+            self.elephants.pop(counter[1], None)
+
+    def handle_connection_down(self, event):
+        self.requests.pop(event.dpid, None)
+        for counter in [counter for counter in self.counters if counter[0] == event.dpid]:
+            del self.counters[counter]
+            self.elephants.pop(counter[1], None)
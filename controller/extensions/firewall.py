@@ -1,59 +1,284 @@
+import random
+import time
 from pox.lib.recoco import Timer
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
 from pox.core import core
+from extensions.udp_rates import UDPRates
+from extensions.switch import FLOW_COOKIE
 
 TIMER_INTERVAL = 2
-UNLOCK_INTERVAL = 10
-MAX_UDP_PACKETS = 50
+# Each switch is polled every TIMER_INTERVAL seconds, faster while it shows
+# suspicious traffic and slower while it stays quiet
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 8
+# Every poll is moved up to this fraction of its interval, so the switches
+# are not all polled at the same time
+POLL_JITTER = 0.2
+# A switch is suspicious when its UDP traffic, or the UDP traffic of all the
+# switches together, goes over this fraction of the blocking rates, then its
+# flows are polled one by one for SUSPICIOUS_POLLS polls
+SUSPICIOUS_FRACTION = 0.5
+SUSPICIOUS_POLLS = 5
+# Seconds a block stays in the switch before it expires by itself
+BLOCK_TIMEOUT = 10
+# Cookie of the drop entries installed by the Firewall
+BLOCK_COOKIE = 0xF1
+# A destination is blocked when the UDP traffic towards it, summed over all
+# the switches, goes over any of these rates
+MAX_UDP_PACKETS_PER_SEC = 500
+MAX_UDP_BYTES_PER_SEC = 5000000
 
 log = core.getLogger()
 
-class Firewall:
+def udp_match():
+    return of.ofp_match(dl_type=pkt.ethernet.IP_TYPE, nw_proto=pkt.ipv4.UDP_PROTOCOL)
+
+def is_near_limit(packet_rate, byte_rate):
+    return (packet_rate > SUSPICIOUS_FRACTION * MAX_UDP_PACKETS_PER_SEC or
+            byte_rate > SUSPICIOUS_FRACTION * MAX_UDP_BYTES_PER_SEC)
+
+class StatsScheduler:
+    """
+    Polls each switch on its own jittered timer. Quiet switches only get an
+    aggregate request for their UDP flows, and their interval grows up to
+    MAX_POLL_INTERVAL. Suspicious switches get the UDP flows one by one every
+    MIN_POLL_INTERVAL.
+
+    The aggregate rates of all the switches are also added up, so a flood
+    spread over many ingress switches, each of them under the limit, still
+    makes every switch carrying UDP traffic suspicious. A flow is counted
+    once per hop in that sum, it only decides which switches are polled in
+    detail; the blocking rates are computed from the flows.
+
+    The aggregate of a switch would also count the packets dropped by the
+    Firewall's own blocks, so switches with blocks are always polled flow by
+    flow and their rates are computed from the forwarding entries only.
+
+    intervals: a dictionary dpid -> current poll interval
+    aggregates: a dictionary dpid -> (packet_count, byte_count, timestamp) of the last aggregate
+    rates: a dictionary dpid -> (packets/sec, bytes/sec) between its last two aggregates
+    suspicious: a dictionary dpid -> remaining detailed polls
+    blocked: a set with the dpids that have blocks installed
+    timers: a dictionary dpid -> Timer of the next poll
+    """
     def __init__(self):
+        core.openflow.addListenerByName("ConnectionUp",
+                                        self.handle_connection_up)
+        core.openflow.addListenerByName("ConnectionDown",
+                                        self.handle_connection_down)
+        core.openflow.addListenerByName("AggregateFlowStatsReceived",
+                                        self.handle_aggregate_stats)
+        self.intervals = {}
+        self.aggregates = {}
+        self.rates = {}
+        self.suspicious = {}
+        self.blocked = set()
+        self.timers = {}
+        for connection in core.openflow.connections:
+            self.start(connection.dpid)
+
+    def handle_connection_up(self, event):
+        self.start(event.dpid)
+
+    def handle_connection_down(self, event):
+        timer = self.timers.pop(event.dpid, None)
+        if timer is not None:
+            timer.cancel()
+        self.intervals.pop(event.dpid, None)
+        self.aggregates.pop(event.dpid, None)
+        self.rates.pop(event.dpid, None)
+        self.suspicious.pop(event.dpid, None)
+
+    def start(self, dpid):
+        if dpid in self.timers:
+            return
+        self.intervals[dpid] = TIMER_INTERVAL
+        # The first poll of each switch is spread over the whole interval
+        self.timers[dpid] = Timer(random.uniform(0, TIMER_INTERVAL), self.poll, args=[dpid])
+
+    def schedule(self, dpid):
+        interval = self.intervals[dpid]
+        delay = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        self.timers[dpid] = Timer(delay, self.poll, args=[dpid])
+
+    def poll(self, dpid):
+        connection = core.openflow.getConnection(dpid)
+        if connection is None or dpid not in self.intervals:
+            self.timers.pop(dpid, None)
+            return
+        if self.suspicious.get(dpid, 0) > 0 or dpid in self.blocked:
+            if dpid in self.suspicious:
+                self.suspicious[dpid] -= 1
+                if self.suspicious[dpid] == 0:
+                    del self.suspicious[dpid]
+                    self.intervals[dpid] = TIMER_INTERVAL
+            connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request(match=udp_match())))
+        else:
+            connection.send(of.ofp_stats_request(body=of.ofp_aggregate_stats_request(match=udp_match())))
+        self.schedule(dpid)
+
+    def is_suspicious(self, dpid):
+        return dpid in self.suspicious
+
+    def mark_suspicious(self, dpid):
+        if dpid not in self.intervals:
+            return
+        self.suspicious[dpid] = SUSPICIOUS_POLLS
+        self.intervals[dpid] = MIN_POLL_INTERVAL
+
+    def handle_aggregate_stats(self, event):
+        if event.connection.dpid in self.blocked:
+            # Polled flow by flow, see update_aggregate
+            return
+        self.update_aggregate(event.connection.dpid, event.stats.packet_count,
+                              event.stats.byte_count, time.time())
+
+    def update_aggregate(self, dpid, packet_count, byte_count, now):
+        """
+        Updates the UDP rate of a switch with its aggregate counters, from an
+        aggregate reply or summed over its forwarding entries
+        """
+        if dpid not in self.intervals:
+            return
+        previous = self.aggregates.get(dpid)
+        self.aggregates[dpid] = (packet_count, byte_count, now)
+        if previous is None or now <= previous[2]:
+            return
+        elapsed = now - previous[2]
+        packet_rate = max(packet_count - previous[0], 0) / elapsed
+        byte_rate = max(byte_count - previous[1], 0) / elapsed
+        self.rates[dpid] = (packet_rate, byte_rate)
+        if is_near_limit(packet_rate, byte_rate):
+            log.debug("Switch %s looks suspicious, polling its flows", dpid)
+            self.mark_suspicious(dpid)
+        elif is_near_limit(sum(rate[0] for rate in self.rates.values()),
+                           sum(rate[1] for rate in self.rates.values())):
+            log.debug("The UDP traffic of all the switches looks suspicious, polling their flows")
+            for other, rate in self.rates.items():
+                if (rate[0] or rate[1]) and not self.is_suspicious(other):
+                    self.mark_suspicious(other)
+            if not self.is_suspicious(dpid):
+                self.intervals[dpid] = min(self.intervals[dpid] * 2, MAX_POLL_INTERVAL)
+        else:
+            self.intervals[dpid] = min(self.intervals[dpid] * 2, MAX_POLL_INTERVAL)
+
+class Firewall:
+    """
+    rates: the UDPRates of every destination, summed over all the switches
+    blocks: a dictionary nw_dst -> set of (dpid, in_port) where it is blocked,
+            it is updated when the blocks expire in the switches
+    """
+    def __init__(self, host_tracker=None):
         core.openflow.addListenerByName("FlowStatsReceived",
                                         self.handle_flow_stats)
-        Timer(TIMER_INTERVAL, Firewall.take_statistics, recurring=True)
-        Timer(UNLOCK_INTERVAL, self.unlock_all, recurring=True)
-        self.locked_ips = set()
+        core.openflow.addListenerByName("ConnectionDown",
+                                        self.handle_connection_down)
+        core.openflow.addListenerByName("FlowRemoved",
+                                        self.handle_flow_removed)
+        self.scheduler = StatsScheduler()
+        # Used to find the edge switch and port of the attacking hosts
+        self.host_tracker = host_tracker
+        self.rates = UDPRates()
+        self.blocks = {}
         self.log = log
 
     @staticmethod
-    def take_statistics():
-        for connection in core.openflow.connections:
-            connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+    def flow_id(f):
+        match = f.match
+        return (f.cookie, (match.dl_src, match.dl_dst, match.nw_src,
+                           match.nw_dst, match.tp_src, match.tp_dst))
 
     def handle_flow_stats(self, event):
-        stats = {}
-        for f in event.stats:
-            if f.match.nw_dst in self.locked_ips:
-                continue
-            if f.match.nw_proto == pkt.ipv4.UDP_PROTOCOL:
-                if f.match.nw_dst not in stats:
-                    stats[f.match.nw_dst] = 1
-                else:
-                    stats[f.match.nw_dst] += 1
-                if stats[f.match.nw_dst] > MAX_UDP_PACKETS:
-                    self.lock(f.match.nw_dst)
-
-    def lock(self, nw_dst):
-        self.log.info("Blocking %s", nw_dst)
-        msg = of.ofp_flow_mod()
-        msg.match.nw_proto = pkt.ipv4.UDP_PROTOCOL
-        msg.priority = of.OFP_DEFAULT_PRIORITY + 1
-        msg.match.nw_dst = nw_dst
-        self.locked_ips.update([nw_dst])
-        for connection in core.openflow.connections:
-            connection.send(msg)
+        dpid = event.connection.dpid
+        now = time.time()
+        # Only the forwarding entries of the UDP flows count, the blocks are dropped traffic
+        entries = [f for f in event.stats
+                   if f.cookie == FLOW_COOKIE and f.match.nw_proto == pkt.ipv4.UDP_PROTOCOL]
+        if dpid in self.scheduler.blocked:
+            self.scheduler.update_aggregate(dpid, sum(f.packet_count for f in entries),
+                                            sum(f.byte_count for f in entries), now)
+        flows = [(Firewall.flow_id(f), f.match.nw_dst, f.match.dl_src,
+                  f.packet_count, f.byte_count, f.duration_sec)
+                 for f in entries if f.match.dl_src is not None]
+        updated = self.rates.update(dpid, flows, now)
 
-    def unlock_all(self):
-        for nw_dst in self.locked_ips:
+        for nw_dst in self.rates.destinations():
+            packet_rate, byte_rate = self.rates.rate(nw_dst, now)
+            if packet_rate > MAX_UDP_PACKETS_PER_SEC or byte_rate > MAX_UDP_BYTES_PER_SEC:
+                self.log.info("UDP traffic to %s at %.0f packets/s, %.0f bytes/s",
+                              nw_dst, packet_rate, byte_rate)
+                attackers = self.rates.attackers(nw_dst, now, MAX_UDP_PACKETS_PER_SEC,
+                                                 MAX_UDP_BYTES_PER_SEC)
+                self.rates.clear(nw_dst)
+                self.lock(nw_dst, attackers)
+            elif nw_dst in updated and is_near_limit(packet_rate, byte_rate):
+                # Every switch sending traffic to a destination close to the limit is
+                # polled in detail, even if its own share is small
+                for source_dpid in set(self.rates.sources.get(nw_dst, {}).values()):
+                    self.scheduler.mark_suspicious(source_dpid)
+
+    def handle_connection_down(self, event):
+        self.rates.forget_switch(event.dpid)
+        for nw_dst, blocks in list(self.blocks.items()):
+            blocks.difference_update([block for block in blocks if block[0] == event.dpid])
+            if not blocks:
+                del self.blocks[nw_dst]
+        self.update_blocked()
+
+    def update_blocked(self):
+        self.scheduler.blocked = set(block[0] for blocks in self.blocks.values() for block in blocks)
+
+    def ingress(self, dl_src, dpid):
+        """
+        The (dpid, port) where the host enters the network. If the host is not
+        known, the switch that reported its flow, on any port.
+        """
+        entry = self.host_tracker.getMacEntry(dl_src) if self.host_tracker else None
+        if entry is None:
+            return (dpid, None)
+        return (entry.dpid, entry.port)
+
+    def lock(self, nw_dst, sources):
+        """
+        Installs a drop entry for the UDP traffic towards nw_dst only in the
+        ingress switch and port of each attacking source. The entries expire by
+        themselves in the switch after BLOCK_TIMEOUT.
+        """
+        blocks = self.blocks.setdefault(nw_dst, set())
+        for dl_src, dpid in sources.items():
+            block = self.ingress(dl_src, dpid)
+            if block in blocks or (block[0], None) in blocks:
+                continue
+            connection = core.openflow.getConnection(block[0])
+            if connection is None:
+                continue
+            self.log.info("Blocking %s from %s at switch %s port %s",
+                          nw_dst, dl_src, block[0], block[1])
             msg = of.ofp_flow_mod()
+            msg.match.in_port = block[1]
+            msg.match.dl_type = pkt.ethernet.IP_TYPE
             msg.match.nw_proto = pkt.ipv4.UDP_PROTOCOL
-            msg.priority = of.OFP_DEFAULT_PRIORITY + 2
             msg.match.nw_dst = nw_dst
-            msg.command = of.OFPFC_DELETE
-            for connection in core.openflow.connections:
-                connection.send(msg)
-            self.locked_ips.remove(nw_dst)
+            msg.priority = of.OFP_DEFAULT_PRIORITY + 1
+            msg.hard_timeout = BLOCK_TIMEOUT
+            msg.cookie = BLOCK_COOKIE
+            msg.flags = of.OFPFF_SEND_FLOW_REM
+            connection.send(msg)
+            blocks.add(block)
+        if not blocks:
+            del self.blocks[nw_dst]
+        self.update_blocked()
 
+    def handle_flow_removed(self, event):
+        if event.ofp.cookie != BLOCK_COOKIE:
+            return
+        match = event.ofp.match
+        blocks = self.blocks.get(match.nw_dst)
+        if blocks is None:
+            return
+        blocks.discard((event.dpid, match.in_port))
+        if not blocks:
+            self.log.info("Unblocked %s", match.nw_dst)
+            del self.blocks[match.nw_dst]
+        self.update_blocked()
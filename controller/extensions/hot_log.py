@@ -0,0 +1,69 @@
+import logging
+import time
+
+# Defaults: every call is considered and each call site emits at most
+# HOT_LOG_RATE messages per second, with bursts of up to HOT_LOG_BURST
+HOT_LOG_SAMPLE = 1
+HOT_LOG_RATE = 10
+HOT_LOG_BURST = 20
+
+
+class HotLog:
+    """
+    Logging for the code that runs on every packet. Each call site (its
+    format string) is sampled, keeping one of every `sample` calls, and
+    rate limited with a token bucket. The message is only formatted, by the
+    logging module, when it is emitted.
+
+    The settings are shared by every HotLog and can be changed at runtime
+    with HotLog.configure, e.g. from the POX py console.
+
+    sites: a dictionary format string -> [calls, tokens, last refill, suppressed]
+    """
+    enabled = True
+    sample = HOT_LOG_SAMPLE
+    rate = HOT_LOG_RATE
+    burst = HOT_LOG_BURST
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.sites = {}
+
+    @classmethod
+    def configure(cls, enabled=None, sample=None, rate=None, burst=None):
+        if enabled is not None:
+            cls.enabled = enabled
+        if sample is not None:
+            cls.sample = max(1, sample)
+        if rate is not None:
+            cls.rate = rate
+        if burst is not None:
+            cls.burst = burst
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def log(self, level, msg, *args):
+        if not HotLog.enabled or not self.logger.isEnabledFor(level):
+            return
+        site = self.sites.get(msg)
+        now = time.time()
+        if site is None:
+            site = self.sites[msg] = [0, HotLog.burst, now, 0]
+        site[0] += 1
+        if site[0] % HotLog.sample:
+            return
+        site[1] = min(HotLog.burst, site[1] + (now - site[2]) * HotLog.rate)
+        site[2] = now
+        if site[1] < 1:
+            site[3] += 1
+            return
+        site[1] -= 1
+        if site[3]:
+            msg += " (%d similar messages suppressed)"
+            args += (site[3],)
+            site[3] = 0
+        self.logger.log(level, msg, *args)
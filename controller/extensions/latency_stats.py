@@ -0,0 +1,77 @@
+from collections import deque
+import time
+
+# Amount of samples of each stage used to compute the percentiles
+LATENCY_SAMPLES = 10000
+
+
+class Span:
+    """Context manager that records the time spent inside it in a stage"""
+    __slots__ = ('stats', 'stage', 'start')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.record(self.stage, time.time() - self.start)
+
+
+class LatencyStats:
+    """
+    Latency of each stage of the flow setup (host lookup, ecmp_path,
+    write_on_tables, send and the whole setup).
+
+    samples: a dictionary stage -> deque with the last LATENCY_SAMPLES durations
+    counts: a dictionary stage -> amount of recorded durations
+    maximums: a dictionary stage -> longest recorded duration
+    """
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.counts = {}
+        self.maximums = {}
+
+    def span(self, stage):
+        return Span(self, stage)
+
+    def record(self, stage, seconds):
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = deque(maxlen=self.max_samples)
+            self.counts[stage] = 0
+            self.maximums[stage] = 0
+        samples.append(seconds)
+        self.counts[stage] += 1
+        if seconds > self.maximums[stage]:
+            self.maximums[stage] = seconds
+
+    def summary(self):
+        """
+        :return: a dictionary stage -> {'count', 'p50_ms', 'p99_ms', 'max_ms'}, the
+        percentiles are of the last samples and the maximum of every sample
+        """
+        summary = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[stage] = {
+                'count': self.counts[stage],
+                'p50_ms': ordered[len(ordered) // 2] * 1000,
+                'p99_ms': ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1000,
+                'max_ms': self.maximums[stage] * 1000,
+            }
+        return summary
+
+    def log_summary(self, log):
+        for stage, stats in sorted(self.summary().items()):
+            log.info("%-16s count %8d  p50 %8.3f ms  p99 %8.3f ms  max %8.3f ms", stage,
+                     stats['count'], stats['p50_ms'], stats['p99_ms'], stats['max_ms'])
+
+    def reset(self):
+        self.samples = {}
+        self.counts = {}
+        self.maximums = {}
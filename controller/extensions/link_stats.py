@@ -0,0 +1,62 @@
+from pox.lib.recoco import Timer
+import pox.openflow.libopenflow_01 as of
+from pox.core import core
+import time
+
+STATS_INTERVAL = 5
+# Weight of the newest sample in the moving average of each link rate
+EWMA_ALPHA = 0.5
+
+log = core.getLogger()
+
+class LinkStats:
+    """
+    Polls the port statistics of every switch and keeps an exponentially
+    weighted moving average of the bytes/sec sent over each link.
+
+    counters: a dictionary (dpid, port) -> (tx_bytes, timestamp) of the last poll
+    rates: a dictionary (dpid, port) -> bytes/sec moving average
+    link_loads: a dictionary (switch, neighbor) -> bytes/sec, shared with ECMPUtil
+    """
+    def __init__(self, store, link_loads, interval=STATS_INTERVAL, alpha=EWMA_ALPHA):
+        core.openflow.addListenerByName("PortStatsReceived",
+                                        self.handle_port_stats)
+        core.openflow.addListenerByName("ConnectionDown",
+                                        self.handle_connection_down)
+        Timer(interval, LinkStats.take_statistics, recurring=True)
+        self.store = store
+        self.link_loads = link_loads
+        self.alpha = alpha
+        self.counters = {}
+        self.rates = {}
+        self.log = log
+
+    @staticmethod
+    def take_statistics():
+        for connection in core.openflow.connections:
+            connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+
+    def handle_port_stats(self, event):
+        dpid = event.connection.dpid
+        now = time.time()
+        for stat in event.stats:
+            key = (dpid, stat.port_no)
+            previous = self.counters.get(key)
+            self.counters[key] = (stat.tx_bytes, now)
+            if previous is None or now <= previous[1] or stat.tx_bytes < previous[0]:
+                # First sample or the counters were reset
+                continue
+            rate = (stat.tx_bytes - previous[0]) / (now - previous[1])
+            if key in self.rates:
+                rate = self.alpha * rate + (1 - self.alpha) * self.rates[key]
+            self.rates[key] = rate
+            neighbor = self.store.get_neighbor(dpid, stat.port_no)
+            if neighbor is not None:
+                self.link_loads[(dpid, neighbor)] = rate
+
+    def handle_connection_down(self, event):
+        for key in [key for key in self.counters if key[0] == event.dpid]:
+            del self.counters[key]
+            self.rates.pop(key, None)
+        for link in [link for link in self.link_loads if link[0] == event.dpid]:
+            del self.link_loads[link]
@@ -1,22 +1,57 @@
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet.ethernet as ethernet
+import pox.lib.packet as pkt
+from extensions.hot_log import HotLog
+import time
 
 log = core.getLogger()
+# Logs de lo que se ejecuta por cada paquete, muestreados y con limite por segundo
+hot_log = HotLog(log)
 
 IPV6_PACKET = 'IPV6'
 
+# Las entradas que instala el controller expiran solas en el switch; la
+# flow_table local es solo una copia de lo que se instalo.
+FLOW_IDLE_TIMEOUT = 10
+FLOW_HARD_TIMEOUT = 30
+# Cookie con la que marcamos los flujos instalados por el controller
+FLOW_COOKIE = 0x7543
+# Prioridad de esas entradas, los borrados estrictos tienen que usar la misma
+FLOW_PRIORITY = of.OFP_DEFAULT_PRIORITY
+
+def flow_key(match):
+  """
+  Devuelve la clave de la flow_table para un match. Los match por flujo se
+  identifican por sus MACs y su 5-tupla, el resto por el par de MACs.
+  """
+  if match.nw_src is None:
+    return (match.dl_src, match.dl_dst)
+  return (match.dl_src, match.dl_dst, match.nw_proto,
+          match.nw_src, match.nw_dst, match.tp_src, match.tp_dst)
+
+def match_from_key(key):
+  """Construye el ofp_match que instala (o borra) la entrada de una clave"""
+  match = of.ofp_match(dl_src=key[0], dl_dst=key[1])
+  if len(key) > 2:
+    match.dl_type = pkt.ethernet.IP_TYPE
+    match.nw_proto, match.nw_src, match.nw_dst, match.tp_src, match.tp_dst = key[2:]
+  return match
+
 class SwitchController:
   def __init__(self, dpid, connection, controller):
     self.controller = controller
     self.dpid = dpid
-    self.connection = connection
-
-    # El SwitchController se agrega como handler de los eventos del switch
-    self.connection.addListeners(self)
+    self.connection = None
+    self.listeners = None
+    # xid del pedido de la tabla del switch para reconciliarla con la flow_table,
+    # None si no se esta esperando ninguna
+    self.reconcile_xid = None
+    self.set_connection(connection)
 
-    #Esta tabla es un diccionario cuya clave es una tupla (mac_origen, mac_destino) y el valor es el
-    #puerto de salida.
+    #Esta tabla es un diccionario cuya clave es una tupla (mac_origen, mac_destino), o en modo por
+    #flujo (mac_origen, mac_destino, proto, ip_origen, ip_destino, puerto_origen, puerto_destino),
+    #y el valor es el puerto de salida. Es una copia de las entradas instaladas en el switch.
     self.flow_table = {}
 
   def _handle_PacketIn(self, event):
@@ -24,61 +59,155 @@ class SwitchController:
       Esta funcion es llamada cada vez que el switch recibe un paquete
       y no encuentra en su tabla una regla para rutearlo
       """
+      start = time.time()
       packet = event.parsed
 
-      self.controller.host_tracker._handle_openflow_PacketIn(event)
+      # El host_tracker ya proceso este paquete: escucha el PacketIn de openflow, que se
+      # dispara antes que el de la conexion del switch.
 
       if ethernet.getNameForType(packet.type) == IPV6_PACKET:
           self.drop(event)
           return
 
-      next_hop = self.get_next_hop(packet)
+      key = self.get_flow_key(packet)
+      # Si ya se esta instalando un camino para este flujo, el paquete espera a que termine,
+      # aunque este switch ya tenga su entrada, para no adelantarse a los paquetes en espera
+      if self.controller.queue_packet(key, self, event):
+          return
+      next_hop = self.get_next_hop(key)
 
       if not next_hop:
-          self.search_for_minimum_path(event)
-          # En caso de que no haya next_hop, en search_for_minimum_path se escribe en la tabla del switch.
-          next_hop = self.get_next_hop(packet)
-          log.info("Founded next hop: %s" % next_hop)
-          if not next_hop:
-              return
+          # En search_for_minimum_path se escriben las tablas de los switches del camino. El paquete
+          # se reenvia cuando todos los switches confirman sus entradas.
+          self.search_for_minimum_path(event, key, start)
+          return
 
-      log.info("Founded entry in switch table.")
+      hot_log.info("Founded entry in switch table.")
 
       self.forward(next_hop, event)
 
+  def set_connection(self, connection):
+      """
+      El SwitchController se agrega como handler de los eventos del switch. Si el switch
+      se reconecta, deja de escuchar la conexion vieja.
+      """
+      if self.connection is not None:
+          self.connection.removeListeners(self.listeners)
+      self.connection = connection
+      self.listeners = connection.addListeners(self)
+
   def _handle_ConnectionDown(self, event):
+      if event.connection is not self.connection:
+          return
       log.info("Switch %s going DOWN", self.dpid)
-      # del self.controller.switchDown(self.connection.dpid)
       self.controller.delete_switch(self.dpid)
 
+  def reconcile(self):
+      """
+      Pide la tabla del switch reconectado para reconciliarla con la flow_table
+      en _handle_FlowStatsReceived, sin tocar el resto de los switches
+      """
+      request = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+      self.reconcile_xid = request.xid
+      self.connection.send(request)
 
+  def _handle_FlowStatsReceived(self, event):
+      """
+      Reconcilia la tabla real del switch con la que espera el controller. Se quedan las
+      entradas cuyo flujo todavia pasa por este switch con la misma salida, se borran
+      las demas y se vuelven a instalar las que el switch perdio.
+      Solo se usa la respuesta al pedido de reconcile: las que piden otros modulos
+      pueden traer solo parte de la tabla.
+      """
+      if self.reconcile_xid is None or event.ofp[0].xid != self.reconcile_xid:
+          return
+      self.reconcile_xid = None
+      installed = {}
+      for stat in event.stats:
+          if stat.cookie != FLOW_COOKIE:
+              continue
+          ports = [action.port for action in stat.actions if isinstance(action, of.ofp_action_output)]
+          installed[flow_key(stat.match)] = ports[0] if ports else None
+      expected_keys = set(installed) | set(self.flow_table)
+      self.flow_table = {}
+      kept, deleted, reinstalled = 0, 0, 0
+      for key in expected_keys:
+          expected = self.controller.expected_next_hop(self.dpid, key)
+          if key in installed and installed[key] == expected:
+              self.flow_table[key] = expected
+              kept += 1
+          elif expected is not None:
+              self.write_on_table(key, expected)
+              reinstalled += 1
+          else:
+              self.delete_entry(key)
+              deleted += 1
+      log.info("Switch %s reconciled: %d entries kept, %d deleted, %d installed again",
+               self.dpid, kept, deleted, reinstalled)
+
+  def _handle_BarrierIn(self, event):
+      self.controller.barrier_received(self.dpid, event.xid)
+
+  def _handle_FlowRemoved(self, event):
+      """
+      Esta funcion es llamada cuando expira (o se borra) una entrada del switch.
+      Mantiene la flow_table sincronizada con la tabla real del switch y le avisa
+      al controller, que olvida el flujo si era la entrada de su switch de ingreso.
+      """
+      if event.ofp.cookie != FLOW_COOKIE:
+          return
+      key = flow_key(event.ofp.match)
+      self.flow_table.pop(key, None)
+      self.controller.flow_removed(self.dpid, key)
+
+  def get_flow_key(self, packet):
+    """
+    En modo por flujo los paquetes IPv4 se identifican por su 5-tupla (tomada
+    con ofp_match.from_packet), el resto siempre por el par de MACs.
+    """
+    if self.controller.per_flow_ecmp and packet.type == packet.IP_TYPE:
+      return flow_key(of.ofp_match.from_packet(packet))
+    return (packet.src, packet.dst)
 
-  def get_next_hop(self, packet):
-    log.info(self.flow_table)
-    src = packet.src
-    destination = packet.dst
-    return self.flow_table.get((src, destination), None)
+  def get_next_hop(self, key):
+    hot_log.debug("Flow table of switch %s: %s", self.dpid, self.flow_table)
+    return self.flow_table.get(key, None)
 
-  def search_for_minimum_path(self, event):
+  def search_for_minimum_path(self, event, key, start=None):
+    """
+    Instala el camino del flujo y mide cuanto tarda cada etapa. start es el momento
+    en que llego el PacketIn, para medir la instalacion completa.
+    """
+    latency = self.controller.latency
     destination = event.parsed.dst
-    destination_entry = self.controller.host_tracker.getMacEntry(destination)
+    with latency.span('host_lookup'):
+      destination_entry = self.controller.host_tracker.getMacEntry(destination)
 
     if destination_entry != None:
-      log.info("port entry is: " + str(destination_entry.port))
-      log.info("dpid entry is: " + str(destination_entry.dpid))
-      log.info("maccadr is: " + str(destination_entry.macaddr))
+      hot_log.info("Destination %s is at switch %s port %s", destination_entry.macaddr,
+                   destination_entry.dpid, destination_entry.port)
 
       switch_origin = self.dpid
       switch_destination = destination_entry.dpid
 
       if switch_origin == switch_destination:
-        log.info("We are in the destination switch. Forwarding to host.")
+        hot_log.info("We are in the destination switch. Forwarding to host.")
+        # Se instala la entrada para que el resto del flujo no pase por el controller
+        self.write_on_table(key, destination_entry.port)
         self.forward(destination_entry.port, event)
         return
 
-      path = self.controller.ecmp_path(switch_origin, switch_destination)
+      flow_hash = None
+      if len(key) > 2:
+        flow_hash = self.controller.flow_hash(key)
+
+      with latency.span('ecmp_path'):
+        path = self.controller.ecmp_path(switch_origin, switch_destination, flow_hash)
 
-      self.controller.write_on_tables(path, event.parsed.src, event.parsed.dst)
+      with latency.span('write_on_tables'):
+        switches = self.controller.write_on_tables(path, key, destination_entry.port, flow_hash)
+      with latency.span('send'):
+        self.controller.wait_for_barriers(key, switches, self, event, start)
 
   def flood_packet(self, event):
     msg = of.ofp_packet_out()
@@ -86,7 +215,7 @@ class SwitchController:
     msg.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
     msg.data = event.ofp
     msg.in_port = event.port
-    log.info("FLOODING PACKET")
+    hot_log.info("FLOODING PACKET")
     self.connection.send(msg)
 
   def forward(self, port, event):
@@ -108,10 +237,36 @@ class SwitchController:
           msg.in_port = event.port
           self.connection.send(msg)
 
-  def write_on_table(self, tuple_macs, next_hop):
-    self.flow_table[tuple_macs] = next_hop
+  def write_on_table(self, key, next_hop):
+    """
+    Instala en el switch una entrada para la clave del flujo que sale por
+    next_hop, y la registra en la flow_table local.
+    """
+    self.flow_table[key] = next_hop
+    msg = of.ofp_flow_mod()
+    msg.match = match_from_key(key)
+    msg.priority = FLOW_PRIORITY
+    msg.idle_timeout = FLOW_IDLE_TIMEOUT
+    msg.hard_timeout = FLOW_HARD_TIMEOUT
+    msg.cookie = FLOW_COOKIE
+    msg.flags = of.OFPFF_SEND_FLOW_REM
+    msg.actions.append(of.ofp_action_output(port=next_hop))
+    self.connection.send(msg)
+
+  def delete_entry(self, key):
+    """
+    Borra una entrada del switch y de la flow_table local. El borrado es estricto:
+    la entrada de un par de MACs no borra las de los flujos por 5-tupla entre esos hosts.
+    """
+    self.flow_table.pop(key, None)
+    msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+    msg.match = match_from_key(key)
+    msg.priority = FLOW_PRIORITY
+    self.connection.send(msg)
 
   def clean_table(self):
+    for key in list(self.flow_table.keys()):
+      self.delete_entry(key)
     self.flow_table = {}
 
   def get_dpid(self):
@@ -0,0 +1,100 @@
+class TopologyStore():
+    """
+    Keeps the controller state indexed so every lookup is O(1)
+
+    switches: a dictionary dpid -> SwitchController
+    topology: a dictionary dpid -> set of (neighbor, port) edges
+    neighbors: a dictionary (dpid, port) -> neighbor dpid
+    incoming: a dictionary dpid -> set of the switches with a link towards it
+    version: a counter that increases on every topology change
+    """
+    def __init__(self):
+        self.switches = {}
+        self.topology = {}
+        self.neighbors = {}
+        self.incoming = {}
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = None
+
+    def has_switch(self, dpid):
+        return dpid in self.switches
+
+    def get_switch(self, dpid):
+        return self.switches.get(dpid)
+
+    def get_switches(self):
+        return list(self.switches.values())
+
+    def get_neighbor(self, dpid, port):
+        return self.neighbors.get((dpid, port))
+
+    def add_switch(self, dpid, switch_controller):
+        self.switches[dpid] = switch_controller
+        self.topology.setdefault(dpid, set())
+        self.incoming.setdefault(dpid, set())
+        self.version += 1
+
+    def remove_switch(self, dpid):
+        """
+        Removes a switch and every link from or towards it
+
+        :return: the SwitchController of the removed switch, or None
+        """
+        for neighbor, port in self.topology.pop(dpid, ()):
+            self.neighbors.pop((dpid, port), None)
+            self.incoming.get(neighbor, set()).discard(dpid)
+        for origin in self.incoming.pop(dpid, ()):
+            edges = self.topology.get(origin, set())
+            for edge in [edge for edge in edges if edge[0] == dpid]:
+                edges.discard(edge)
+                self.neighbors.pop((origin, edge[1]), None)
+        self.version += 1
+        return self.switches.pop(dpid, None)
+
+    def has_link(self, dpid1, port, dpid2):
+        return (dpid2, port) in self.topology.get(dpid1, ())
+
+    def add_link(self, dpid1, port, dpid2):
+        """
+        Adds the link that leaves dpid1 through port towards dpid2
+
+        :return: False if the link was already known
+        :raises ValueError: if any of the switches is not in the store
+        """
+        for dpid in (dpid1, dpid2):
+            if dpid not in self.switches:
+                raise ValueError("Unknown switch %s" % (dpid,))
+        if self.has_link(dpid1, port, dpid2):
+            return False
+        self.topology.setdefault(dpid1, set()).add((dpid2, port))
+        self.neighbors[(dpid1, port)] = dpid2
+        self.incoming.setdefault(dpid2, set()).add(dpid1)
+        self.version += 1
+        return True
+
+    def remove_link(self, dpid1, port, dpid2):
+        """
+        Removes the link that leaves dpid1 through port towards dpid2
+
+        :return: False if the link was not known
+        """
+        if not self.has_link(dpid1, port, dpid2):
+            return False
+        self.topology[dpid1].discard((dpid2, port))
+        self.neighbors.pop((dpid1, port), None)
+        if not any(edge[0] == dpid2 for edge in self.topology[dpid1]):
+            self.incoming.get(dpid2, set()).discard(dpid1)
+        self.version += 1
+        return True
+
+    def snapshot(self):
+        """
+        Returns a copy of the topology as a dictionary of frozensets of
+        (neighbor, port). The frozensets are shared until the topology changes,
+        changing the dictionary does not change the store.
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = {dpid: frozenset(edges) for dpid, edges in self.topology.items()}
+            self._snapshot_version = self.version
+        return dict(self._snapshot)
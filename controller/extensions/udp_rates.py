@@ -0,0 +1,162 @@
+from collections import deque
+
+# Seconds of statistics used to compute the rate of each destination
+RATE_WINDOW = 10
+
+
+class UDPRates:
+    """
+    Rate of the UDP traffic towards each destination, summed over all the
+    switches, computed from the counters of their flow entries.
+
+    counters: a dictionary (dpid, flow) -> (packet_count, byte_count, timestamp)
+              with the last snapshot of each flow entry. They are kept while the
+              entry is in the switch, even if it is not polled for a while, as the
+              baseline of the next poll.
+    flows_by_dpid: a dictionary dpid -> set of the flows with counters in that switch
+    flow_owner: a dictionary flow -> dpid of the switch whose counters are used
+                for that flow, so a flow is not counted once per hop
+    samples: a dictionary nw_dst -> deque of (timestamp, packets, bytes, by_source),
+             by_source being a dictionary dl_src -> (packets, bytes) of the sample
+    totals: a dictionary nw_dst -> [packets, bytes] summed over its samples
+    source_totals: a dictionary nw_dst -> {dl_src: [packets, bytes, samples]} summed
+                   over the samples of each source
+    sources: a dictionary nw_dst -> {dl_src: dpid} of the hosts sending UDP to it,
+             with the switch that reported the flow
+    """
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.counters = {}
+        self.flows_by_dpid = {}
+        self.flow_owner = {}
+        self.samples = {}
+        self.totals = {}
+        self.source_totals = {}
+        self.sources = {}
+
+    def update(self, dpid, flows, now):
+        """
+        Adds the traffic of the flow entries of a switch since its last poll.
+        Deltas that span more than the window only count their share of it, as
+        if the traffic was evenly spread.
+
+        :param flows: every UDP flow entry of the switch, as tuples
+                      (flow, nw_dst, dl_src, packet_count, byte_count, duration_sec)
+        :return: the set of destinations that got new traffic
+        """
+        deltas = {}
+        seen = set()
+        for flow, nw_dst, dl_src, packet_count, byte_count, duration in flows:
+            seen.add(flow)
+            previous = self.counters.get((dpid, flow))
+            self.counters[(dpid, flow)] = (packet_count, byte_count, now)
+            if self.flow_owner.setdefault(flow, dpid) != dpid:
+                continue
+            if previous is None or packet_count < previous[0] or byte_count < previous[1]:
+                # A new entry, or installed again so its counters started from zero
+                packets, byte_delta, elapsed = packet_count, byte_count, duration
+            else:
+                packets = packet_count - previous[0]
+                byte_delta = byte_count - previous[1]
+                elapsed = now - previous[2]
+            if packets == 0:
+                continue
+            share = min(1.0, float(self.window) / elapsed) if elapsed > 0 else 1.0
+            delta = deltas.setdefault(nw_dst, [0, 0, {}])
+            delta[0] += packets * share
+            delta[1] += byte_delta * share
+            source = delta[2].setdefault(dl_src, [0, 0])
+            source[0] += packets * share
+            source[1] += byte_delta * share
+            self.sources.setdefault(nw_dst, {})[dl_src] = dpid
+        self.forget(dpid, self.flows_by_dpid.get(dpid, set()) - seen)
+        self.flows_by_dpid[dpid] = seen
+        for nw_dst, (packets, byte_count, by_source) in deltas.items():
+            self.add_sample(nw_dst, now, packets, byte_count, by_source)
+        return set(deltas)
+
+    def forget_switch(self, dpid):
+        self.forget(dpid, self.flows_by_dpid.pop(dpid, set()))
+
+    def forget(self, dpid, flows):
+        """Forgets the counters of the flow entries that are no longer in the switch"""
+        for flow in flows:
+            del self.counters[(dpid, flow)]
+            if self.flow_owner.get(flow) == dpid:
+                del self.flow_owner[flow]
+
+    def add_sample(self, nw_dst, timestamp, packets, byte_count, by_source):
+        self.samples.setdefault(nw_dst, deque()).append((timestamp, packets, byte_count, by_source))
+        total = self.totals.setdefault(nw_dst, [0, 0])
+        total[0] += packets
+        total[1] += byte_count
+        source_totals = self.source_totals.setdefault(nw_dst, {})
+        for dl_src, (source_packets, source_bytes) in by_source.items():
+            source_total = source_totals.setdefault(dl_src, [0, 0, 0])
+            source_total[0] += source_packets
+            source_total[1] += source_bytes
+            source_total[2] += 1
+
+    def destinations(self):
+        return list(self.samples)
+
+    def rate(self, nw_dst, now):
+        """
+        Drops the samples older than the window and returns the
+        (packets/sec, bytes/sec) towards nw_dst over the window
+        """
+        samples = self.samples.get(nw_dst)
+        if samples is None:
+            return 0, 0
+        total = self.totals[nw_dst]
+        source_totals = self.source_totals[nw_dst]
+        while samples and samples[0][0] <= now - self.window:
+            _, packets, byte_count, by_source = samples.popleft()
+            total[0] -= packets
+            total[1] -= byte_count
+            for dl_src, (source_packets, source_bytes) in by_source.items():
+                source_total = source_totals[dl_src]
+                source_total[0] -= source_packets
+                source_total[1] -= source_bytes
+                source_total[2] -= 1
+                if not source_total[2]:
+                    del source_totals[dl_src]
+        if not samples:
+            self.clear(nw_dst)
+            return 0, 0
+        return float(total[0]) / self.window, float(total[1]) / self.window
+
+    def attackers(self, nw_dst, now, max_packets, max_bytes):
+        """
+        The sources whose traffic takes the destination over the rates: the
+        fastest senders, until the rest together stay under both of them.
+        A slow sender is not an attacker just for sending to the same destination.
+
+        :return: a dictionary dl_src -> dpid of the switch that reported it
+        """
+        packet_rate, byte_rate = self.rate(nw_dst, now)
+        sources = self.sources.get(nw_dst, {})
+        rates = sorted(((float(packets) / self.window, float(byte_count) / self.window, dl_src)
+                        for dl_src, (packets, byte_count, _) in self.source_totals.get(nw_dst, {}).items()),
+                       key=lambda rate: max(rate[0] / max_packets, rate[1] / max_bytes),
+                       reverse=True)
+        attackers = {}
+        for source_packets, source_bytes, dl_src in rates:
+            if packet_rate <= max_packets and byte_rate <= max_bytes:
+                break
+            if dl_src in sources:
+                attackers[dl_src] = sources[dl_src]
+            packet_rate -= source_packets
+            byte_rate -= source_bytes
+        return attackers
+
+    def clear(self, nw_dst):
+        """
+        Forgets the samples of a destination
+
+        :return: its sources, a dictionary dl_src -> dpid
+        """
+        self.samples.pop(nw_dst, None)
+        self.totals.pop(nw_dst, None)
+        self.source_totals.pop(nw_dst, None)
+        return self.sources.pop(nw_dst, {})
@@ -0,0 +1,328 @@
+"""
+Emulated fabric to load test the controller without Mininet.
+
+Creates one pox.datapaths.switch.SoftwareSwitch per switch of the topology,
+in the same process as the controller, and connects each of them to POX over
+an in-process loopback transport instead of a TCP socket. Once discovery
+finds every link, the hosts announce themselves and send one UDP packet per
+synthetic flow between random pairs of hosts. At the end it logs the flow
+setup rate and the latency from the first packet of each flow until it
+reaches its destination host (PacketIn, path computation, flow_mods,
+barriers and forwarding).
+
+The topologies are the ones of benchmark.py (levels:3, fat_tree:4,
+leaf_spine:4:16, ...), with the hosts connected to the edge switches:
+
+  ./pox.py example --per_flow fabric --topology=fat_tree:4 --flows=1000 --rate=200 --quit
+"""
+from pox.core import core
+from pox.lib.recoco import Timer
+from pox.lib.util import str_to_bool
+from pox.lib.addresses import EthAddr, IPAddr, ETHER_BROADCAST
+from pox.datapaths.switch import SoftwareSwitch, ExpireMixin, OFConnection
+import pox.openflow.of_01 as of_01
+import pox.lib.packet as pkt
+from benchmark import build_topology
+import random
+import time
+
+log = core.getLogger()
+
+# Buffers of each switch for the packets sent to the controller
+SWITCH_BUFFERS = 1024
+# Seconds between each check of the links found by discovery
+DISCOVERY_CHECK_INTERVAL = 1
+# Seconds between the hosts announcement and the first flow
+ANNOUNCE_DELAY = 1
+# Seconds between each batch of injected flows
+INJECT_INTERVAL = 0.01
+# Seconds to wait for the packets still in flight after the last flow
+FLOW_TIMEOUT = 10
+
+
+class FabricSwitch(ExpireMixin, SoftwareSwitch):
+    pass
+
+
+class LoopbackPipe(object):
+    """
+    In-process transport between a SoftwareSwitch and an of_01.Connection.
+    The bytes written on one end are delivered to the other one from the
+    recoco loop (core.callLater), so a message never re-enters its sender
+    and consecutive writes are delivered together.
+    """
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.closed = False
+        self.controller_socket = LoopbackSocket(self)
+        self.switch_worker = LoopbackWorker(self)
+        self.connection = None
+        self.to_switch_scheduled = False
+        self.to_controller_scheduled = False
+
+    def connect(self, switch):
+        switch.set_connection(OFConnection(self.switch_worker))
+        # Creating the Connection sends the hello, the switch answers it and
+        # of_01 raises ConnectionUp once the handshake is done
+        self.connection = of_01.Connection(self.controller_socket)
+
+    def close(self):
+        self.closed = True
+
+    def send_to_switch(self, data):
+        if self.closed:
+            return
+        self.switch_worker.buf += data
+        if not self.to_switch_scheduled:
+            self.to_switch_scheduled = True
+            core.callLater(self.deliver_to_switch)
+
+    def send_to_controller(self, data):
+        if self.closed:
+            return
+        self.controller_socket.buf += data
+        if not self.to_controller_scheduled:
+            self.to_controller_scheduled = True
+            core.callLater(self.deliver_to_controller)
+
+    def deliver_to_switch(self):
+        self.to_switch_scheduled = False
+        if not self.closed and self.switch_worker.buf:
+            self.switch_worker.rx_handler(self.switch_worker)
+
+    def deliver_to_controller(self):
+        self.to_controller_scheduled = False
+        while not self.closed and self.controller_socket.buf:
+            if self.connection.read() is False:
+                self.connection.close()
+
+
+class LoopbackSocket(object):
+    """Controller end of a LoopbackPipe, the socket of the of_01.Connection"""
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.buf = b''
+
+    def send(self, data):
+        self.pipe.send_to_switch(data)
+        return len(data)
+
+    def recv_into(self, buf, size):
+        data, self.buf = self.buf[:size], self.buf[size:]
+        buf[:len(data)] = data
+        return len(data)
+
+    def getpeername(self):
+        return ('loopback', self.pipe.dpid)
+
+    def fileno(self):
+        return -1
+
+    def setblocking(self, flag):
+        pass
+
+    def shutdown(self, how):
+        self.pipe.close()
+
+    def close(self):
+        self.pipe.close()
+
+
+class LoopbackWorker(object):
+    """Switch end of a LoopbackPipe, the io_worker of the switch OFConnection"""
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.socket = pipe.controller_socket
+        self.rx_handler = None
+        self.buf = b''
+
+    def send(self, data):
+        self.pipe.send_to_controller(data)
+
+    def peek(self, length=None):
+        return self.buf if length is None else self.buf[:length]
+
+    def consume_receive_buf(self, length):
+        self.buf = self.buf[length:]
+
+
+class Host(object):
+    def __init__(self, number, dpid, port):
+        self.mac = EthAddr("%012x" % number)
+        self.ip = IPAddr(0x0a000000 + number)
+        self.dpid = dpid
+        self.port = port
+
+
+def udp_packet(src, dst, tp_src, tp_dst):
+    datagram = pkt.udp(srcport=tp_src, dstport=tp_dst)
+    datagram.payload = b'fabric'
+    ip = pkt.ipv4(srcip=src.ip, dstip=dst.ip, protocol=pkt.ipv4.UDP_PROTOCOL)
+    ip.payload = datagram
+    frame = pkt.ethernet(src=src.mac, dst=dst.mac, type=pkt.ethernet.IP_TYPE)
+    frame.payload = ip
+    return frame
+
+
+def arp_packet(opcode, src, dst_mac, dst_ip):
+    message = pkt.arp(opcode=opcode, hwsrc=src.mac, protosrc=src.ip,
+                      hwdst=dst_mac, protodst=dst_ip)
+    frame = pkt.ethernet(src=src.mac, dst=dst_mac, type=pkt.ethernet.ARP_TYPE)
+    frame.payload = message
+    return frame
+
+
+class Fabric(object):
+    """
+    switches: a dictionary dpid -> FabricSwitch
+    links: a dictionary (dpid, port) -> (neighbor dpid, neighbor port)
+    hosts: a list of Host, hosts_by_port indexes them by (dpid, port)
+    started: a dictionary flow id -> time its first packet was injected
+    latencies: the seconds each delivered flow took to reach its destination
+    """
+    def __init__(self, topology, hosts_per_edge, flows, rate, seed, quit):
+        self.flows = flows
+        self.rate = rate
+        self.quit = quit
+        self.random = random.Random(seed)
+        self.switches = {}
+        self.links = {}
+        self.hosts = []
+        self.hosts_by_port = {}
+        self.pipes = []
+        self.started = {}
+        self.latencies = []
+        self.sent = 0
+        self.credit = 0
+        self.first_sent = None
+        self.last_delivered = None
+        self.packet_ins = 0
+
+        adjacency, edges = build_topology(topology)
+        self.build(adjacency, edges, hosts_per_edge)
+        core.addListenerByName("UpEvent", self.start)
+
+    def build(self, adjacency, edges, hosts_per_edge):
+        for dpid, edges_of_switch in adjacency.items():
+            ports = {port: neighbor for neighbor, port in edges_of_switch}
+            last_port = max(ports) if ports else 0
+            host_ports = hosts_per_edge if dpid in edges else 0
+            self.switches[dpid] = FabricSwitch(dpid=dpid, name="sw%d" % dpid,
+                                               ports=last_port + host_ports,
+                                               max_buffers=SWITCH_BUFFERS)
+            for port in range(last_port + 1, last_port + host_ports + 1):
+                host = Host(len(self.hosts) + 1, dpid, port)
+                self.hosts.append(host)
+                self.hosts_by_port[(dpid, port)] = host
+            self.switches[dpid].addListenerByName("DpPacketOut", self.handle_packet_out)
+        for dpid, edges_of_switch in adjacency.items():
+            for neighbor, port in edges_of_switch:
+                back_port = [p for n, p in adjacency[neighbor] if n == dpid][0]
+                self.links[(dpid, port)] = (neighbor, back_port)
+        log.info("Fabric with %d switches, %d links and %d hosts",
+                 len(self.switches), len(self.links) // 2, len(self.hosts))
+
+    def start(self, event):
+        core.openflow.addListenerByName("PacketIn", self.count_packet_in)
+        for dpid, switch in sorted(self.switches.items()):
+            pipe = LoopbackPipe(dpid)
+            pipe.connect(switch)
+            self.pipes.append(pipe)
+        Timer(DISCOVERY_CHECK_INTERVAL, self.wait_for_links, recurring=True)
+
+    def count_packet_in(self, event):
+        self.packet_ins += 1
+
+    def wait_for_links(self):
+        found = len(core.openflow_discovery.adjacency)
+        if found < len(self.links):
+            log.info("Waiting for discovery: %d of %d links", found, len(self.links))
+            return True
+        log.info("Every link was discovered, announcing the hosts")
+        for host in self.hosts:
+            self.send(host, arp_packet(pkt.arp.REQUEST, host, ETHER_BROADCAST, host.ip))
+        Timer(ANNOUNCE_DELAY, self.start_flows)
+        return False
+
+    def start_flows(self):
+        if len(set(host.dpid for host in self.hosts)) < 2:
+            log.error("The fabric needs hosts on at least two switches")
+            return
+        log.info("Sending %d flows at %d flows/sec", self.flows, self.rate)
+        self.first_sent = time.time()
+        Timer(INJECT_INTERVAL, self.inject, recurring=True)
+
+    def inject(self):
+        self.credit += self.rate * INJECT_INTERVAL
+        while self.credit >= 1 and self.sent < self.flows:
+            self.credit -= 1
+            self.send_flow(self.sent)
+            self.sent += 1
+        if self.sent < self.flows:
+            return True
+        Timer(FLOW_TIMEOUT, self.report)
+        return False
+
+    def send_flow(self, number):
+        src = self.random.choice(self.hosts)
+        dst = self.random.choice([host for host in self.hosts if host.dpid != src.dpid])
+        # Every flow has its own pair of UDP ports
+        tp_src, tp_dst = 1024 + number % 50000, 1024 + number // 50000
+        self.started[(src.mac, dst.mac, tp_src, tp_dst)] = time.time()
+        self.send(src, udp_packet(src, dst, tp_src, tp_dst))
+
+    def send(self, host, packet):
+        self.switches[host.dpid].rx_packet(packet, host.port)
+
+    def handle_packet_out(self, event):
+        port = (event.switch.dpid, event.port.port_no)
+        if port in self.links:
+            neighbor, neighbor_port = self.links[port]
+            core.callLater(self.switches[neighbor].rx_packet, event.packet, neighbor_port)
+        elif port in self.hosts_by_port:
+            self.receive(self.hosts_by_port[port], event.packet)
+
+    def receive(self, host, packet):
+        message = packet.find('arp')
+        if message is not None:
+            # host_tracker pings the hosts with ARP requests
+            if message.opcode == pkt.arp.REQUEST and message.protodst == host.ip:
+                self.send(host, arp_packet(pkt.arp.REPLY, host, message.hwsrc, message.protosrc))
+            return
+        datagram = packet.find('udp')
+        if datagram is None or packet.dst != host.mac:
+            return
+        start = self.started.pop((packet.src, packet.dst, datagram.srcport, datagram.dstport), None)
+        if start is not None:
+            self.last_delivered = time.time()
+            self.latencies.append(self.last_delivered - start)
+
+    def report(self):
+        delivered = len(self.latencies)
+        log.info("Flows sent: %d, delivered: %d, lost: %d, PacketIns: %d",
+                 self.sent, delivered, self.sent - delivered, self.packet_ins)
+        if delivered:
+            latencies = sorted(self.latencies)
+            elapsed = self.last_delivered - self.first_sent
+            log.info("Flow setup rate: %.1f flows/sec", delivered / elapsed if elapsed else 0)
+            log.info("Path install latency: p50 %.2f ms, p99 %.2f ms, max %.2f ms",
+                     latencies[delivered // 2] * 1000,
+                     latencies[min(int(delivered * 0.99), delivered - 1)] * 1000,
+                     latencies[-1] * 1000)
+        if core.hasComponent("Controller"):
+            core.Controller.dump_latency()
+        if self.quit:
+            core.quit()
+
+
+def launch(topology="levels:3", hosts=1, flows=1000, rate=200, seed=0, quit=False):
+    """
+    --topology=<spec> topologia de benchmark.py, por ejemplo fat_tree:4
+    --hosts=<n> hosts por cada switch edge
+    --flows=<n> cantidad de flujos sinteticos
+    --rate=<n> flujos nuevos por segundo
+    --seed=<n> semilla de la eleccion de los hosts de cada flujo
+    --quit cierra POX despues de informar los resultados
+    """
+    core.register("fabric", Fabric(topology, int(hosts), int(flows), int(rate),
+                                   int(seed), str_to_bool(quit)))
@@ -0,0 +1,145 @@
+"""
+Tests of the path cache of ECMPUtil, without POX running
+"""
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from extensions.ecmp_utils import ECMPUtil
+
+
+def diamond():
+    """
+    Two equal cost paths between 1 and 4, through 2 or 3. The port of each
+    link is the dpid of the switch it goes to.
+    """
+    links = {1: [2, 3], 2: [1, 4], 3: [1, 4], 4: [2, 3]}
+    return {sw: set((neighbor, neighbor) for neighbor in neighbors)
+            for sw, neighbors in links.items()}
+
+
+class ECMPUtilTest(unittest.TestCase):
+    def setUp(self):
+        self.ecmp = ECMPUtil()
+        self.ecmp.update(diamond())
+
+    def test_shortest_path(self):
+        path = self.ecmp.get_path(1, 4)
+        self.assertEqual(len(path), 3)
+        self.assertEqual(path[0][0], 1)
+        self.assertIn(path[0][1], (2, 3))
+        self.assertEqual(path[1], (path[0][1], 4))
+        self.assertEqual(path[2], 4)
+
+    def test_same_path_while_cached(self):
+        self.assertEqual(self.ecmp.get_path(1, 4), self.ecmp.get_path(1, 4))
+        self.assertEqual(len(self.ecmp.paths), 1)
+
+    def test_least_used_next_hop(self):
+        middle = self.ecmp.get_path(1, 4)[1][0]
+        self.assertEqual(self.ecmp.use_counts[(1, middle)], 1)
+        self.assertEqual(self.ecmp.shortest_path(1, 4), [1, 5 - middle, 4])
+
+    def test_reverse_index(self):
+        path = self.ecmp.get_path(1, 4)
+        middle = path[1][0]
+        self.assertEqual(self.ecmp.paths_by_link[(1, middle)], set([(1, 4)]))
+        self.assertEqual(self.ecmp.paths_by_link[(middle, 4)], set([(1, 4)]))
+        self.ecmp.forget_path((1, 4))
+        self.assertEqual(self.ecmp.paths_by_link, {})
+        self.assertEqual(self.ecmp.use_counts[(1, middle)], 0)
+
+    def test_remove_link_invalidates_only_its_paths(self):
+        path = self.ecmp.get_path(1, 4)
+        middle = path[1][0]
+        other = self.ecmp.get_path(2, 1)
+        invalidated = self.ecmp.remove_link(1, middle)
+        self.assertEqual(invalidated, {(1, 4): [1, middle, 4]})
+        self.assertNotIn((1, 4), self.ecmp.paths)
+        self.assertEqual(self.ecmp.get_path(2, 1), other)
+        new_path = self.ecmp.get_path(1, 4)
+        self.assertNotEqual(new_path[1][0], middle)
+
+    def test_add_link_keeps_paths(self):
+        self.ecmp.get_path(1, 4)
+        self.assertEqual(self.ecmp.add_link(1, 4, 4), {})
+        self.assertIn((1, 4), self.ecmp.paths)
+        self.ecmp.forget_path((1, 4))
+        self.assertEqual(self.ecmp.get_path(1, 4), [(1, 4), 4])
+
+    def test_use_backup(self):
+        path = self.ecmp.get_path(1, 4)
+        middle = path[1][0]
+        invalidated = self.ecmp.remove_link(middle, 4)
+        backup = self.ecmp.use_backup((1, 4), invalidated[(1, 4)])
+        self.assertEqual(backup, [(1, 5 - middle), (5 - middle, 4), 4])
+        self.assertIn((1, 4), self.ecmp.paths)
+
+    def test_backup_per_pair(self):
+        middle = self.ecmp.get_path(1, 4)[1][0]
+        self.assertEqual(self.ecmp.backups, {(1, 4): [1, 5 - middle, 4]})
+        self.ecmp.get_path(1, 4, flow_hash=7)
+        self.assertEqual(len(self.ecmp.backups), 1)
+        self.assertEqual(self.ecmp.backups_by_link[(1, 5 - middle)], set([(1, 4)]))
+
+    def test_failed_link_drops_the_backups_using_it(self):
+        middle = self.ecmp.get_path(1, 4)[1][0]
+        self.ecmp.remove_link(5 - middle, 4)
+        self.assertEqual(self.ecmp.backups, {})
+        self.assertIn((1, 4), self.ecmp.paths)
+
+    def test_flows_of_a_pair_share_the_backup(self):
+        keys = [(1, 4, flow_hash) for flow_hash in range(8)]
+        for key in keys:
+            self.ecmp.get_path(*key)
+        middle = self.ecmp.paths[keys[0]][1]
+        backup = self.ecmp.backups[(1, 4)]
+        invalidated = self.ecmp.remove_link(1, middle)
+        for key, old_path in invalidated.items():
+            self.assertEqual(self.ecmp.use_backup(key, old_path), self.ecmp.hops(backup))
+        self.assertIs(self.ecmp.backups[(1, 4)], backup)
+
+    def test_backup_dropped_with_the_last_path(self):
+        self.ecmp.get_path(1, 4)
+        self.ecmp.forget_path((1, 4))
+        self.assertEqual(self.ecmp.backups, {})
+        self.assertEqual(self.ecmp.backups_by_link, {})
+
+    def test_use_backup_without_disjoint_path(self):
+        self.ecmp.update({1: set([(2, 2)]), 2: set([(1, 1), (3, 3)]), 3: set([(2, 2)])})
+        self.ecmp.get_path(1, 3)
+        invalidated = self.ecmp.remove_link(2, 3)
+        self.assertEqual(self.ecmp.use_backup((1, 3), invalidated[(1, 3)]), [])
+        self.assertNotIn((1, 3), self.ecmp.paths)
+
+    def test_evicts_least_recently_used(self):
+        self.ecmp.max_paths = 2
+        self.ecmp.get_path(1, 4)
+        self.ecmp.get_path(4, 1)
+        self.ecmp.get_path(1, 4)
+        self.ecmp.get_path(2, 3)
+        self.assertEqual(set(self.ecmp.paths), set([(1, 4), (2, 3)]))
+        self.assertEqual(list(self.ecmp.pop_evicted()), [(4, 1)])
+        self.assertEqual(self.ecmp.pop_evicted(), {})
+
+    def test_held_paths_are_not_evicted(self):
+        self.ecmp.max_paths = 1
+        self.ecmp.get_path(1, 4)
+        self.ecmp.hold((1, 4))
+        self.ecmp.get_path(4, 1)
+        self.assertEqual(set(self.ecmp.paths), set([(1, 4), (4, 1)]))
+        self.ecmp.get_path(2, 3)
+        self.assertEqual(set(self.ecmp.paths), set([(1, 4), (2, 3)]))
+        self.assertEqual(list(self.ecmp.pop_evicted()), [(4, 1)])
+
+    def test_forgotten_paths_are_not_held(self):
+        self.ecmp.get_path(1, 4)
+        self.ecmp.hold((1, 4))
+        self.ecmp.forget_path((1, 4))
+        self.assertEqual(self.ecmp.held, set())
+        self.assertNotIn((1, 4), self.ecmp.idle)
+
+
+if __name__ == '__main__':
+    unittest.main()
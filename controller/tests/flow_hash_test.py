@@ -0,0 +1,86 @@
+"""
+Tests of the per flow mode: the 5-tuple flow keys and their hashed paths
+"""
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+sys.path.append(os.path.dirname(__file__) + "/../../pox")
+from extensions.ecmp_utils import ECMPUtil, flow_hash
+
+try:
+    import pox.openflow.libopenflow_01 as of
+    from pox.lib.addresses import EthAddr, IPAddr
+    from extensions.switch import flow_key, match_from_key
+except (ImportError, SyntaxError):
+    # POX is python 2 only
+    of = None
+
+SRC = "00:00:00:00:00:01"
+DST = "00:00:00:00:00:02"
+
+
+def udp_key(tp_src, dl_src=SRC, dl_dst=DST):
+    return (dl_src, dl_dst, 17, "10.0.0.1", "10.0.0.2", tp_src, 53)
+
+
+def diamond():
+    links = {1: [2, 3], 2: [1, 4], 3: [1, 4], 4: [2, 3]}
+    return {sw: set((neighbor, neighbor) for neighbor in neighbors)
+            for sw, neighbors in links.items()}
+
+
+class FlowHashTest(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertEqual(flow_hash(udp_key(1000), 5), flow_hash(udp_key(1000), 5))
+
+    def test_only_the_five_tuple(self):
+        self.assertEqual(flow_hash(udp_key(1000)),
+                         flow_hash(udp_key(1000, dl_src="00:00:00:00:00:03")))
+        self.assertNotEqual(flow_hash(udp_key(1000)), flow_hash(udp_key(1001)))
+
+    def test_seed(self):
+        keys = [udp_key(port) for port in range(1000, 1032)]
+        self.assertNotEqual([flow_hash(key, 0) for key in keys],
+                            [flow_hash(key, 1) for key in keys])
+
+    def test_same_flow_same_path(self):
+        # Every ECMPUtil seeds random with the time, the hashed paths must not depend on it
+        key = udp_key(1000)
+        paths = []
+        for _ in range(5):
+            ecmp = ECMPUtil()
+            ecmp.update(diamond())
+            paths.append(ecmp.get_path(1, 4, flow_hash(key, 3)))
+        self.assertEqual(len(set(map(tuple, paths))), 1)
+
+    def test_flows_spread_over_the_paths(self):
+        ecmp = ECMPUtil()
+        ecmp.update(diamond())
+        middles = set()
+        for port in range(1000, 1032):
+            middles.add(ecmp.get_path(1, 4, flow_hash(udp_key(port)))[1][0])
+        self.assertEqual(middles, set([2, 3]))
+
+
+@unittest.skipIf(of is None, "POX is not available")
+class FlowKeyTest(unittest.TestCase):
+    def test_five_tuple_key(self):
+        match = of.ofp_match(dl_src=EthAddr(SRC), dl_dst=EthAddr(DST), dl_type=0x800,
+                             nw_proto=17, nw_src=IPAddr("10.0.0.1"),
+                             nw_dst=IPAddr("10.0.0.2"), tp_src=1000, tp_dst=53)
+        key = flow_key(match)
+        self.assertEqual(key, (EthAddr(SRC), EthAddr(DST), 17, IPAddr("10.0.0.1"),
+                               IPAddr("10.0.0.2"), 1000, 53))
+        self.assertEqual(flow_key(match_from_key(key)), key)
+
+    def test_mac_pair_key(self):
+        match = of.ofp_match(dl_src=EthAddr(SRC), dl_dst=EthAddr(DST))
+        key = flow_key(match)
+        self.assertEqual(key, (EthAddr(SRC), EthAddr(DST)))
+        self.assertEqual(flow_key(match_from_key(key)), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
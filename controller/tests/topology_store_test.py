@@ -0,0 +1,77 @@
+"""
+Tests of TopologyStore, without POX running
+"""
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from extensions.topology_store import TopologyStore
+
+
+class TopologyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TopologyStore()
+        for dpid in (1, 2, 3):
+            self.store.add_switch(dpid, "switch %d" % dpid)
+
+    def test_add_link(self):
+        self.assertTrue(self.store.add_link(1, 5, 2))
+        self.assertFalse(self.store.add_link(1, 5, 2))
+        self.assertTrue(self.store.has_link(1, 5, 2))
+        self.assertFalse(self.store.has_link(2, 5, 1))
+        self.assertEqual(self.store.get_neighbor(1, 5), 2)
+        self.assertEqual(self.store.incoming[2], set([1]))
+
+    def test_add_link_of_unknown_switch(self):
+        self.assertRaises(ValueError, self.store.add_link, 1, 5, 4)
+        self.assertRaises(ValueError, self.store.add_link, 4, 5, 1)
+        self.assertNotIn(4, self.store.topology)
+        self.assertNotIn(4, self.store.incoming)
+
+    def test_remove_link(self):
+        self.store.add_link(1, 5, 2)
+        self.store.add_link(1, 6, 2)
+        self.assertTrue(self.store.remove_link(1, 5, 2))
+        self.assertFalse(self.store.remove_link(1, 5, 2))
+        self.assertIsNone(self.store.get_neighbor(1, 5))
+        # There is still another link from 1 towards 2
+        self.assertEqual(self.store.incoming[2], set([1]))
+        self.store.remove_link(1, 6, 2)
+        self.assertEqual(self.store.incoming[2], set())
+
+    def test_remove_switch(self):
+        self.store.add_link(1, 5, 2)
+        self.store.add_link(2, 1, 1)
+        self.store.add_link(3, 2, 2)
+        self.assertEqual(self.store.remove_switch(2), "switch 2")
+        self.assertFalse(self.store.has_switch(2))
+        self.assertEqual(self.store.topology, {1: set(), 3: set()})
+        self.assertEqual(self.store.neighbors, {})
+        self.assertEqual(self.store.incoming[1], set())
+
+    def test_version(self):
+        version = self.store.version
+        self.store.add_link(1, 5, 2)
+        self.store.add_link(1, 5, 2)
+        self.assertEqual(self.store.version, version + 1)
+        self.store.remove_link(1, 5, 2)
+        self.assertEqual(self.store.version, version + 2)
+
+    def test_snapshot(self):
+        self.store.add_link(1, 5, 2)
+        snapshot = self.store.snapshot()
+        self.assertEqual(snapshot, {1: frozenset([(2, 5)]), 2: frozenset(), 3: frozenset()})
+        self.store.add_link(2, 1, 1)
+        self.assertEqual(snapshot[2], frozenset())
+        self.assertEqual(self.store.snapshot()[2], frozenset([(1, 1)]))
+
+    def test_snapshot_is_a_copy(self):
+        snapshot = self.store.snapshot()
+        snapshot[1] = frozenset([(3, 7)])
+        del snapshot[2]
+        self.assertEqual(self.store.snapshot(), {1: frozenset(), 2: frozenset(), 3: frozenset()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Tests of the UDP rates the Firewall uses to find floods, without POX running
+"""
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from extensions.udp_rates import UDPRates
+
+DST = "10.0.0.1"
+
+
+def flow(name, packet_count, byte_count, duration=0, dl_src="00:00:00:00:00:01"):
+    return (name, DST, dl_src, packet_count, byte_count, duration)
+
+
+class UDPRatesTest(unittest.TestCase):
+    def setUp(self):
+        self.rates = UDPRates(window=10)
+
+    def test_unknown_destination(self):
+        self.assertEqual(self.rates.rate(DST, 0), (0, 0))
+
+    def test_new_entry(self):
+        self.assertEqual(self.rates.update(1, [flow("a", 100, 1000, duration=5)], 0), set([DST]))
+        self.assertEqual(self.rates.rate(DST, 0), (10.0, 100.0))
+
+    def test_new_entry_older_than_the_window(self):
+        self.rates.update(1, [flow("a", 100, 1000, duration=20)], 0)
+        self.assertEqual(self.rates.rate(DST, 0), (5.0, 50.0))
+
+    def test_delta_since_last_poll(self):
+        self.rates.update(1, [flow("a", 10, 100)], 0)
+        self.rates.update(1, [flow("a", 60, 600)], 5)
+        self.assertEqual(self.rates.rate(DST, 5), (6.0, 60.0))
+
+    def test_delta_longer_than_the_window(self):
+        self.rates.update(1, [flow("a", 10, 100)], 0)
+        self.rates.update(1, [flow("a", 210, 2100)], 20)
+        # Only half of the delta falls in the window, the first sample expired
+        self.assertEqual(self.rates.rate(DST, 20), (10.0, 100.0))
+
+    def test_baseline_is_kept_without_traffic(self):
+        self.rates.update(1, [flow("a", 10, 100)], 0)
+        self.assertEqual(self.rates.update(1, [flow("a", 10, 100)], 5), set())
+        self.rates.update(1, [flow("a", 30, 300)], 8)
+        self.assertEqual(self.rates.counters[(1, "a")], (30, 300, 8))
+        self.assertEqual(self.rates.rate(DST, 8), (3.0, 30.0))
+
+    def test_reinstalled_entry(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.rates.update(1, [flow("a", 20, 200, duration=2)], 4)
+        self.assertEqual(self.rates.rate(DST, 4), (12.0, 120.0))
+
+    def test_flow_counted_once_per_path(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.rates.update(2, [flow("a", 100, 1000)], 0)
+        self.assertEqual(self.rates.rate(DST, 0), (10.0, 100.0))
+        self.assertEqual(self.rates.flow_owner, {"a": 1})
+
+    def test_owner_changes_when_the_entry_expires(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.rates.update(2, [flow("a", 100, 1000)], 0)
+        self.rates.update(1, [], 1)
+        self.assertNotIn((1, "a"), self.rates.counters)
+        self.rates.update(2, [flow("a", 150, 1500)], 1)
+        self.assertEqual(self.rates.flow_owner, {"a": 2})
+        self.assertEqual(self.rates.rate(DST, 1), (15.0, 150.0))
+
+    def test_forget_switch(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.rates.forget_switch(1)
+        self.assertEqual(self.rates.counters, {})
+        self.assertEqual(self.rates.flow_owner, {})
+
+    def test_flows_add_up(self):
+        self.rates.update(1, [flow("a", 100, 1000, dl_src="00:00:00:00:00:01")], 0)
+        self.rates.update(2, [flow("b", 50, 500, dl_src="00:00:00:00:00:02")], 0)
+        self.assertEqual(self.rates.rate(DST, 0), (15.0, 150.0))
+        self.assertEqual(self.rates.clear(DST), {"00:00:00:00:00:01": 1, "00:00:00:00:00:02": 2})
+        self.assertEqual(self.rates.rate(DST, 0), (0, 0))
+
+    def test_attackers(self):
+        self.rates.update(1, [flow("a", 9000, 90000, dl_src="00:00:00:00:00:01")], 0)
+        self.rates.update(2, [flow("b", 800, 8000, dl_src="00:00:00:00:00:02"),
+                              flow("c", 700, 7000, dl_src="00:00:00:00:00:03")], 0)
+        # 1050 packets/s, the slow senders alone stay under 500
+        self.assertEqual(self.rates.attackers(DST, 0, 500, 10 ** 9),
+                         {"00:00:00:00:00:01": 1})
+
+    def test_several_attackers(self):
+        self.rates.update(1, [flow("a", 6000, 60000, dl_src="00:00:00:00:00:01"),
+                              flow("b", 6000, 60000, dl_src="00:00:00:00:00:02"),
+                              flow("c", 100, 1000, dl_src="00:00:00:00:00:03")], 0)
+        self.assertEqual(self.rates.attackers(DST, 0, 500, 10 ** 9),
+                         {"00:00:00:00:00:01": 1, "00:00:00:00:00:02": 1})
+
+    def test_no_attackers_under_the_limit(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.assertEqual(self.rates.attackers(DST, 0, 500, 10 ** 9), {})
+
+    def test_source_rates_expire(self):
+        self.rates.update(1, [flow("a", 9000, 90000, dl_src="00:00:00:00:00:01")], 0)
+        self.rates.update(1, [flow("a", 9000, 90000, dl_src="00:00:00:00:00:01"),
+                              flow("b", 100, 1000, dl_src="00:00:00:00:00:02")], 5)
+        self.assertEqual(self.rates.rate(DST, 12), (10.0, 100.0))
+        self.assertEqual(list(self.rates.source_totals[DST]), ["00:00:00:00:00:02"])
+
+    def test_samples_expire(self):
+        self.rates.update(1, [flow("a", 100, 1000)], 0)
+        self.assertEqual(self.rates.rate(DST, 10), (0, 0))
+        self.assertEqual(self.rates.destinations(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
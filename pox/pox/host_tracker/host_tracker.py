@@ -32,6 +32,8 @@ You can set various timeouts from the commandline.  Names and defaults:
   arpReply=4       Time to wait for an ARP reply before retrial
   timerInterval=5  Seconds between timer routine activations
   entryMove=60     Minimum expected time to move a physical entry
+  fullUpdate=5     Seconds a known host is only refreshed before it is fully
+                   processed again
 
 Good values for testing:
   --arpAware=15 --arpSilent=45 --arpReply=1 --entryMove=4
@@ -67,7 +69,9 @@ timeoutSec = dict(
   arpSilent=60*20, # This is for uiet entries not known to answer ARP
   arpReply=4,      # Time to wait for an ARP reply before retrial
   timerInterval=5, # Seconds between timer routine activations
-  entryMove=60     # Minimum expected time to move a physical entry
+  entryMove=60,    # Minimum expected time to move a physical entry
+  fullUpdate=5     # Seconds a known host is only refreshed before it is
+                   # fully processed again
   )
 
 # Address to send ARP pings from.
@@ -183,6 +187,7 @@ class MacEntry (Alive):
     self.port = port
     self.macaddr = macaddr
     self.ipAddrs = {}
+    self.lastFullUpdate = 0
 
   def __str__(self):
     return ' '.join([str(self.dpid), str(self.port), str(self.macaddr)])
@@ -222,6 +227,11 @@ class host_tracker (EventMixin):
 
     # The following tables should go to Topology later
     self.entryByMAC = {}
+
+    # Packets from known hosts at their known location only refresh the
+    # entry.  These count how often that fast path was taken.
+    self.fastPathHits = 0
+    self.fullUpdates = 0
     self._t = Timer(timeoutSec['timerInterval'],
                     self._check_timeouts, recurring=True)
 
@@ -345,6 +355,18 @@ class host_tracker (EventMixin):
 
     if packet.type == ethernet.LLDP_TYPE: # Ignore LLDP packets
       return
+
+    # Fast path: a host we already know, at the same place, and whose full
+    # update is recent enough.  ARP still goes the long way since it carries
+    # the replies to our pings.
+    macEntry = self.entryByMAC.get(packet.src)
+    if (macEntry is not None and packet.type != ethernet.ARP_TYPE and
+        macEntry.dpid == dpid and macEntry.port == inport and
+        time.time() - macEntry.lastFullUpdate < timeoutSec['fullUpdate']):
+      macEntry.refresh()
+      self.fastPathHits += 1
+      return
+
     # This should use Topology later
     if not core.openflow_discovery.is_edge_port(dpid, inport):
       # No host should be right behind a switch-only port
@@ -377,9 +399,11 @@ class host_tracker (EventMixin):
       e = HostEvent(macEntry, move=True, new_dpid = dpid, new_port = inport)
       self.raiseEventNoErrors(e)
       macEntry.dpid = e._new_dpid
-      macEntry.inport = e._new_port
+      macEntry.port = e._new_port
 
     macEntry.refresh()
+    macEntry.lastFullUpdate = macEntry.lastTimeSeen
+    self.fullUpdates += 1
 
     (pckt_srcip, hasARP) = self.getSrcIPandARP(packet.next)
     if pckt_srcip is not None:
@@ -392,6 +416,8 @@ class host_tracker (EventMixin):
     """
     Checks for timed out entries
     """
+    log.debug("PacketIn fast path hits: %i, full updates: %i",
+              self.fastPathHits, self.fullUpdates)
     for macEntry in self.entryByMAC.values():
       entryPinged = False
       for ip_addr, ipEntry in macEntry.ipAddrs.items():
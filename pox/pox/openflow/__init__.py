@@ -240,6 +240,31 @@ class BarrierIn (Event):
     self.dpid = connection.dpid
     self.xid = ofp.xid
 
+class SendQueueFull (Event):
+  """
+  Fired when the data waiting to be sent to a switch goes over the high
+  watermark of its send queue, because the switch is not reading it as
+  fast as we send.  It's a good time to stop sending it more.
+  queued (int) - bytes waiting in the queue
+  """
+  def __init__ (self, connection, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.queued = queued
+
+class SendQueueDrained (Event):
+  """
+  Fired when the send queue of a switch that raised SendQueueFull goes
+  back under the low watermark.
+  queued (int) - bytes waiting in the queue
+  """
+  def __init__ (self, connection, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.queued = queued
+
 class ConnectionIn (Event):
   def __init__ (self, connection):
     super(ConnectionIn,self).__init__()
@@ -312,6 +337,8 @@ class OpenFlowNexus (EventMixin):
     PacketIn,
     BarrierIn,
     ErrorIn,
+    SendQueueFull,
+    SendQueueDrained,
     RawStatsReply,
     SwitchDescReceived,
     FlowStatsReceived,
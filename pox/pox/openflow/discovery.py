@@ -32,6 +32,7 @@ import pox.lib.packet as pkt
 
 import struct
 import time
+import itertools
 from collections import namedtuple
 from random import shuffle, random
 
@@ -246,6 +247,7 @@ class Discovery (EventMixin):
   _flow_priority = 65000     # Priority of LLDP-catching flow (if any)
   _link_timeout = 10         # How long until we consider a link dead
   _timeout_check_period = 5  # How often to check for timeouts
+  _resync_size = 500         # Links per full resync message to other workers
 
   _eventMixin_events = set([
     LinkEvent,
@@ -263,6 +265,12 @@ class Discovery (EventMixin):
     if link_timeout: self._link_timeout = link_timeout
 
     self.adjacency = {} # From Link to time.time() stamp
+    # Links discovered by other OpenFlow workers (see of_01.Shards), from
+    # Link to the time.time() they were last announced.  The messages
+    # between workers may be dropped, so every worker announces all its
+    # links every _timeout_check_period and the ones that are not announced
+    # for _link_timeout expire.
+    self.remote_links = {}
     self._sender = LLDPSender(self.send_cycle_time)
 
     # Listen with a high priority (mostly so we get PacketIns early)
@@ -270,6 +278,60 @@ class Discovery (EventMixin):
         listen_args={'openflow':{'priority':0xffffffff}})
 
     Timer(self._timeout_check_period, self._expire_links, recurring=True)
+    core.call_when_ready(self._listen_to_shards, 'of_01')
+
+  def _listen_to_shards (self):
+    if getattr(core.of_01, 'shards', None) is not None:
+      core.of_01.addListenerByName("ShardMessage", self._handle_ShardMessage)
+
+  def _is_remote (self, dpid):
+    """
+    True if the switch is handled by another OpenFlow worker
+    """
+    shards = getattr(core.of_01, 'shards', None)
+    return shards is not None and not shards.owns(dpid)
+
+  def _send_to_shards (self, kind, data):
+    if getattr(core.of_01, 'shards', None) is not None:
+      core.of_01.send_to_shards((self._core_name, kind, data))
+
+  def _handle_ShardMessage (self, event):
+    """
+    Applies the link changes seen by the other workers, so every worker
+    has the whole topology
+    """
+    if not isinstance(event.message, (tuple, list)) or len(event.message) != 3:
+      return
+    name, kind, data = event.message
+    if name != self._core_name:
+      return
+    if kind == 'link_up':
+      self._remote_link_up(Link(*data))
+    elif kind == 'links':
+      for link in data:
+        self._remote_link_up(Link(*link))
+    elif kind == 'link_down':
+      link = Link(*data)
+      if link in self.remote_links:
+        del self.remote_links[link]
+        self.raiseEventNoErrors(LinkEvent, False, link)
+    elif kind == 'switch_down':
+      self._delete_switch_links(data)
+
+  def _remote_link_up (self, link):
+    if link in self.adjacency:
+      return
+    if link not in self.remote_links:
+      self.raiseEventNoErrors(LinkEvent, True, link)
+    self.remote_links[link] = time.time()
+
+  def _resync_shards (self):
+    """
+    Announces every link of this worker to the others
+    """
+    links = [tuple(link) for link in self.adjacency]
+    for i in range(0, len(links), self._resync_size):
+      self._send_to_shards('links', links[i:i+self._resync_size])
 
   @property
   def send_cycle_time (self):
@@ -302,10 +364,18 @@ class Discovery (EventMixin):
       self.install_flow(event.connection)
 
   def _handle_openflow_ConnectionDown (self, event):
+    self._delete_switch_links(event.dpid)
+    self._send_to_shards('switch_down', event.dpid)
+
+  def _delete_switch_links (self, dpid):
     # Delete all links on this switch
     self._delete_links([link for link in self.adjacency
-                        if link.dpid1 == event.dpid
-                        or link.dpid2 == event.dpid])
+                        if link.dpid1 == dpid
+                        or link.dpid2 == dpid])
+    for link in [link for link in self.remote_links
+                 if link.dpid1 == dpid or link.dpid2 == dpid]:
+      del self.remote_links[link]
+      self.raiseEventNoErrors(LinkEvent, False, link)
 
   def _expire_links (self):
     """
@@ -321,6 +391,15 @@ class Discovery (EventMixin):
 
       self._delete_links(expired)'''
 
+    if (core.hasComponent('of_01') and
+        getattr(core.of_01, 'shards', None) is not None):
+      self._resync_shards()
+      for link in [link for link, timestamp in self.remote_links.items()
+                   if timestamp + self._link_timeout < now]:
+        log.info('remote link timeout: %s', link)
+        del self.remote_links[link]
+        self.raiseEventNoErrors(LinkEvent, False, link)
+
   def _handle_openflow_PacketIn (self, event):
     """
     Receive and process LLDP packets
@@ -408,7 +487,8 @@ class Discovery (EventMixin):
       log.warning("Couldn't find a DPID in the LLDP packet")
       return EventHalt
 
-    if originatorDPID not in core.openflow.connections:
+    if (originatorDPID not in core.openflow.connections
+        and not self._is_remote(originatorDPID)):
       log.info('Received LLDP packet from unknown switch')
       return EventHalt
 
@@ -442,6 +522,7 @@ class Discovery (EventMixin):
       self.adjacency[link] = time.time()
       log.info('link detected: %s', link)
       self.raiseEventNoErrors(LinkEvent, True, link)
+      self._send_to_shards('link_up', tuple(link))
     else:
       # Just update timestamp
       self.adjacency[link] = time.time()
@@ -451,6 +532,7 @@ class Discovery (EventMixin):
   def _delete_links (self, links):
     for link in links:
       self.raiseEventNoErrors(LinkEvent, False, link)
+      self._send_to_shards('link_down', tuple(link))
     for link in links:
       self.adjacency.pop(link, None)
 
@@ -458,7 +540,7 @@ class Discovery (EventMixin):
     """
     Return True if given port does not connect to another switch
     """
-    for link in self.adjacency:
+    for link in itertools.chain(self.adjacency, self.remote_links):
       if link.dpid1 == dpid and link.port1 == port:
         return False
       if link.dpid2 == dpid and link.port2 == port:
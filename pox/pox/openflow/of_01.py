@@ -22,7 +22,7 @@ from pox.core import core
 import pox
 import pox.lib.util
 from pox.lib.addresses import EthAddr
-from pox.lib.revent.revent import EventMixin
+from pox.lib.revent.revent import EventMixin, Event
 import datetime
 import time
 from pox.lib.socketcapture import CaptureSocket
@@ -34,29 +34,36 @@ log = core.getLogger()
 
 import socket
 import select
+import struct
 
 # List where the index is an OpenFlow message type (OFPT_xxx), and
 # the values are unpack functions that unpack the wire format of that
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
-import threading
+# Bytes asked to the socket on each Connection.read.  A burst of PacketIns
+# is then received with a few recv_into calls instead of one every 2KB.
+READ_SIZE = 65536
+# Buffered bytes that make Connection.send flush right away instead of
+# waiting for the end of the loop turn
+FLUSH_SIZE = 65536
+# Bytes waiting in the send queue of a switch that is not reading them
+# which raise SendQueueFull and, once sent down to the low one,
+# SendQueueDrained.  Past the limit the switch is disconnected.
+SEND_QUEUE_HIGH = 1 << 20
+SEND_QUEUE_LOW = 1 << 18
+SEND_QUEUE_LIMIT = 16 << 20
+
 import os
 import sys
 import exceptions
+import subprocess
+import json
+import contextlib
+import collections
+import threading
 from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
 
 
@@ -87,6 +94,11 @@ def handle_FLOW_REMOVED (con, msg): #A
 
 def handle_FEATURES_REPLY (con, msg):
   connecting = con.connect_time == None
+  if connecting and _shards is not None and not _shards.owns(msg.datapath_id):
+    # Another worker handles this switch
+    con.dpid = msg.datapath_id
+    if _shards.hand_off(con):
+      return
   con.features = msg
   con.original_ports._ports = set(msg.ports)
   con.ports._reset()
@@ -270,113 +282,6 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
-  """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    threading.Thread.__init__(self)
-    core.addListeners(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.sending = False
-
-    self.start()
-
-  def _handle_GoingDownEvent (self, event):
-    self._waker.ping()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 5)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
-
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
     log.warning("%s raised on dummy OpenFlow nexus" % event)
@@ -459,6 +364,13 @@ class OFCaptureSocket (CaptureSocket):
       self._sbuf = self._sbuf[packet_length:]
       l = len(self._sbuf)
 
+  def recv_into (self, buf, nbytes = 0):
+    # Connection.read receives into its buffer, but the capture works on
+    # the strings returned by recv
+    data = self.recv(nbytes or len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
 
 class PortCollection (object):
   """
@@ -576,6 +488,8 @@ class Connection (EventMixin):
     PacketIn,
     ErrorIn,
     BarrierIn,
+    SendQueueFull,
+    SendQueueDrained,
     RawStatsReply,
     SwitchDescReceived,
     FlowStatsReceived,
@@ -589,6 +503,9 @@ class Connection (EventMixin):
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # Bytes read from the socket at once (see launch)
+  read_size = READ_SIZE
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -600,12 +517,30 @@ class Connection (EventMixin):
     #print str(self), m
     log.info(str(self) + " " + str(m))
 
-  def __init__ (self, sock):
+  def __init__ (self, sock, adopted = False):
+    """
+    adopted is True for a connection handed off by another worker: the
+    switch already got our hello, so we only ask for its features again
+    """
     self._previous_stats = []
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    # Receive buffer.  The unread bytes are the ones in [buf_start, buf_end);
+    # at most they are the start of a message that is not complete yet.
+    self.buf = bytearray(self.read_size)
+    self.buf_start = 0
+    self.buf_end = 0
+    # Packed messages not sent yet and their length (see send)
+    self.wbuf = []
+    self.wbuf_len = 0
+    # Depth of the batch() blocks being run
+    self.batching = 0
+    # Data the switch didn't take yet, sent when the socket is writable
+    self.send_queue = collections.deque()
+    self.send_queue_len = 0
+    # True from SendQueueFull until SendQueueDrained
+    self.congested = False
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -614,10 +549,15 @@ class Connection (EventMixin):
     self.features = None
     self.disconnected = False
     self.disconnection_raised = False
+    # True once the connection was passed to the worker that owns its dpid
+    self.handed_off = False
     self.connect_time = None
     self.idle_time = time.time()
 
-    self.send(of.ofp_hello())
+    if adopted:
+      self.send(of.ofp_features_request())
+    else:
+      self.send(of.ofp_hello())
 
     self.original_ports = PortCollection()
     self.ports = PortCollection()
@@ -637,6 +577,10 @@ class Connection (EventMixin):
     return self.sock.fileno()
 
   def close (self):
+    if self.handed_off:
+      # The socket lives on in the owner worker, just drop our descriptor
+      self.sock.close()
+      return
     self.disconnect('closed')
     try:
       self.sock.close()
@@ -647,6 +591,9 @@ class Connection (EventMixin):
     """
     disconnect this Connection (usually not invoked manually).
     """
+    if not self.disconnected:
+      # What was sent right before disconnecting still goes out
+      self.flush()
     if self.disconnected:
       self.msg("already disconnected")
     self.info(msg)
@@ -661,11 +608,9 @@ class Connection (EventMixin):
         self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
         self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    self.send_queue.clear()
+    self.send_queue_len = 0
+    _write_waiting.discard(self)
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -682,6 +627,12 @@ class Connection (EventMixin):
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+
+    The data is buffered and every message sent to the switch during a
+    turn of the loop goes out with a single send when the turn ends (or
+    once FLUSH_SIZE bytes are buffered).  See also flush() and batch().
+    It can be called from any thread, the socket is only written from the
+    OpenFlow loop.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -691,64 +642,175 @@ class Connection (EventMixin):
       assert isinstance(data, of.ofp_header)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
+    with _unflushed_lock:
+      self.wbuf.append(data)
+      self.wbuf_len += len(data)
+      flush_now = self.wbuf_len >= FLUSH_SIZE and _in_loop_thread()
+      if not flush_now:
+        _unflushed.add(self)
+    if flush_now:
+      self._flush()
+    else:
+      _schedule_flush()
+
+  def flush (self):
+    """
+    Sends the buffered messages now.  From a thread other than the
+    OpenFlow loop's, it only asks the loop to send them.
+    """
+    if not _in_loop_thread():
+      with _unflushed_lock:
+        if not self.wbuf: return
+        _unflushed.add(self)
+      _schedule_flush()
+      return
+    self._flush()
+
+  def _flush (self):
+    """
+    Writes the buffered messages to the socket, only from the recoco thread
+    """
+    with _unflushed_lock:
+      if not self.wbuf: return
+      if len(self.wbuf) == 1:
+        data = self.wbuf[0]
+      else:
+        data = b''.join(self.wbuf)
+      self.wbuf = []
+      self.wbuf_len = 0
+    if self.disconnected: return
+
+    if self.send_queue:
+      # It goes after the data the switch didn't take yet
+      self._enqueue(data)
       return
     try:
       l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
     except socket.error as (errno, strerror):
-      if errno == EAGAIN:
-        self.msg("Out of send buffer space.  " +
-                 "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
-      else:
+      if errno != EAGAIN:
         self.msg("Socket error: " + strerror)
         self.disconnect(defer_event=True)
+        return
+      l = 0
+    if l != len(data):
+      self.msg("Didn't send complete buffer.")
+      self._enqueue(data[l:])
+
+  def _enqueue (self, data):
+    """
+    Queues data the socket didn't take, the OpenFlow loop sends it once
+    the socket is writable (see _send_queued)
+    """
+    if self.send_queue_len + len(data) > SEND_QUEUE_LIMIT:
+      self.err("Send queue over %i bytes, the switch is not reading"
+               % (SEND_QUEUE_LIMIT,))
+      self.disconnect(defer_event=True)
+      return
+    if not self.send_queue:
+      _write_waiting.add(self)
+      _waker.ping()
+    self.send_queue.append(data)
+    self.send_queue_len += len(data)
+    if not self.congested and self.send_queue_len >= SEND_QUEUE_HIGH:
+      self.congested = True
+      self.info("Send queue full (%i bytes)" % (self.send_queue_len,))
+      e = self.ofnexus.raiseEventNoErrors(SendQueueFull, self,
+                                          self.send_queue_len)
+      if e is None or e.halt != True:
+        self.raiseEventNoErrors(SendQueueFull, self, self.send_queue_len)
+
+  def _send_queued (self):
+    """
+    Sends as much of the send queue as the socket takes.  Called by the
+    OpenFlow loop when the socket is writable.
+    """
+    while self.send_queue:
+      data = self.send_queue[0]
+      try:
+        l = self.sock.send(data)
+      except socket.error as (errno, strerror):
+        if errno != EAGAIN:
+          self.msg("Socket error: " + strerror)
+          self.disconnect(defer_event=True)
+        break
+      self.send_queue_len -= l
+      if l != len(data):
+        self.send_queue[0] = data[l:]
+        break
+      self.send_queue.popleft()
+    if not self.send_queue:
+      _write_waiting.discard(self)
+    if self.congested and self.send_queue_len <= SEND_QUEUE_LOW:
+      self.congested = False
+      self.info("Send queue drained")
+      e = self.ofnexus.raiseEventNoErrors(SendQueueDrained, self,
+                                          self.send_queue_len)
+      if e is None or e.halt != True:
+        self.raiseEventNoErrors(SendQueueDrained, self, self.send_queue_len)
+
+  @contextlib.contextmanager
+  def batch (self):
+    """
+    Sends everything sent in the block together when the block ends, e.g.
+
+      with connection.batch():
+        for fm in flow_mods:
+          connection.send(fm)
+        connection.send(of.ofp_barrier_request())
+    """
+    self.batching += 1
+    try:
+      yield self
+    finally:
+      self.batching -= 1
+      if self.batching == 0:
+        self.flush()
 
   def read (self):
     """
     Read data from this connection.  Generally this is just called by the
     main OpenFlow loop below.
 
+    The data is received straight into the buffer and every complete
+    message is unpacked from it in place: the unpackers get a read-only
+    buffer object and an offset, so the only copies are the fields
+    they slice (which are plain strings).
+
     Note: This function will block if data is not available.
     """
+    if len(self.buf) - self.buf_end < self.read_size:
+      self._make_room()
     try:
-      d = self.sock.recv(2048)
+      d = self.sock.recv_into(memoryview(self.buf)[self.buf_end:],
+                              self.read_size)
     except:
       return False
-    if len(d) == 0:
+    if d == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
-
+    self.buf_end += d
+    buf_len = self.buf_end
+    # Slicing a buffer gives strings, which is what libopenflow expects
+    view = buffer(self.buf, 0, buf_len)
 
-    offset = 0
+    offset = self.buf_start
     while buf_len - offset >= 8: # 8 bytes is minimum OF message size
-      # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
-
-      ofp_type = ord(self.buf[offset+1])
+      # We unpack the first four bytes of the OpenFlow header by hand
+      # to find the version/length/type so that we can correctly call
+      # libopenflow to unpack it.
+      version, ofp_type, msg_length = struct.unpack_from("!BBH", view, offset)
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
+      if version != of.OFP_VERSION:
         if ofp_type == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+                      % (version, self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
-
       if buf_len - offset < msg_length: break
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
+      new_offset,msg = unpackers[ofp_type](view, offset)
       assert new_offset - offset == msg_length
       offset = new_offset
 
@@ -760,12 +822,32 @@ class Connection (EventMixin):
                       "%s %s", self,self,
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
+      if self.handed_off:
+        return False
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
+    if offset == buf_len:
+      # Everything was consumed, the next read starts at the beginning
+      self.buf_start = self.buf_end = 0
+    else:
+      self.buf_start = offset
 
     return True
 
+  def _make_room (self):
+    """
+    Moves the unread bytes to the front of the buffer, and grows it when
+    they are part of a message bigger than the buffer, so there is room
+    for a whole read after them
+    """
+    pending = self.buf_end - self.buf_start
+    if self.buf_start:
+      self.buf[:pending] = self.buf[self.buf_start:self.buf_end]
+      self.buf_start = 0
+      self.buf_end = pending
+    missing = pending + self.read_size - len(self.buf)
+    if missing > 0:
+      self.buf.extend(bytearray(missing))
+
   def _incoming_stats_reply (self, ofp):
     # This assumes that you don't receive multiple stats replies
     # to different requests out of order/interspersed.
@@ -825,17 +907,210 @@ def wrap_socket (new_sock):
   return new_sock
 
 
+# Environment variable with the index of a worker process and the file
+# descriptors of its channels, see _start_workers
+SHARD_ENV = "POX_OF_01_SHARD"
+
+class ShardMessage (Event):
+  """
+  Raised by core.of_01 when another worker sends something with
+  send_to_shards()
+  """
+  def __init__ (self, shard, message):
+    Event.__init__(self)
+    self.shard = shard
+    self.message = message
+
+
+class Shards (object):
+  """
+  Spreads the switch connections across worker processes
+  (openflow.of_01 --workers=N, Linux only).
+
+  Every worker is a whole POX process started with the same command line
+  and listening on the same port (SO_REUSEPORT), so the kernel spreads the
+  new connections. When a switch sends its FEATURES_REPLY, its socket is
+  passed to the worker that owns its dpid, which asks for the features
+  again and raises ConnectionUp. So all the events of a switch are handled
+  by the components of a single worker.
+
+  Each worker has a handoff and a message channel, a datagram socketpair
+  created by the first worker before starting the others: the worker keeps
+  the receiving end and every worker inherits the sending ends, so no other
+  process can pass sockets or messages to them.
+
+  Components that need the state of every switch share it with
+  core.of_01.send_to_shards(message), which the other workers get as a
+  ShardMessage event raised by core.of_01. A message is dropped when the
+  channel of a worker is full, so components must resend their state from
+  time to time: discovery announces all its links every few seconds and
+  expires the remote links that are not announced. Only discovery shares
+  its state: the hosts seen by host_tracker stay in the worker of each
+  switch.
+
+  peers: the (handoff, message) sending sockets of each worker
+  """
+  def __init__ (self, index, count, handoff_socket, message_socket, peers):
+    self.index = index
+    self.count = count
+    self.handoff_socket = handoff_socket
+    self.message_socket = message_socket
+    self.peers = peers
+    for sock in [handoff_socket, message_socket]:
+      sock.setblocking(0)
+    for handoff, message in peers:
+      message.setblocking(0)
+
+  def owner (self, dpid):
+    return dpid % self.count
+
+  def owns (self, dpid):
+    return self.owner(dpid) == self.index
+
+  def hand_off (self, con):
+    """
+    Passes the connection to the worker that owns its dpid
+
+    Returns False if it could not be passed, so it is kept here.
+    """
+    import _multiprocessing
+    # Our messages are sent before the socket changes hands
+    con.flush()
+    if con.send_queue:
+      log.warning("%s has data waiting to be sent, handling it here", con)
+      return False
+    owner = self.owner(con.dpid)
+    try:
+      _multiprocessing.sendfd(self.peers[owner][0].fileno(),
+                              con.sock.fileno())
+    except (socket.error, OSError):
+      log.warning("%s could not be passed to worker %s, handling it here",
+                  con, owner)
+      return False
+    con.handed_off = True
+    con.info("passed to worker %s" % (owner,))
+    return True
+
+  def adopt (self):
+    """
+    Returns a Connection for a socket passed by another worker
+    """
+    import _multiprocessing
+    fd = _multiprocessing.recvfd(self.handoff_socket.fileno())
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    os.close(fd)
+    sock.setblocking(0)
+    return Connection(sock, adopted = True)
+
+  def send (self, message):
+    data = json.dumps([self.index, message])
+    for index, (handoff, sock) in enumerate(self.peers):
+      if index == self.index: continue
+      try:
+        sock.send(data)
+      except socket.error:
+        log.warning("Could not send a message to worker %s, its channel "
+                    "is full", index)
+
+  def receive (self):
+    """
+    Returns the (worker, message) sent by another worker, or None if
+    the message is not valid
+    """
+    try:
+      shard, message = json.loads(self.message_socket.recv(1 << 20))
+    except ValueError:
+      log.warning("Invalid message from another worker")
+      return None
+    return shard, message
+
+
+def _close_fds (fds):
+  for fd in fds:
+    os.close(fd)
+
+def _start_workers (count):
+  """
+  Creates the channels of every worker and starts the other workers with
+  the same command line as this one
+
+  Returns the Shards of this worker
+  """
+  channels = [(socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM),
+               socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM))
+              for index in range(count)]
+  senders = [[handoff[1].fileno(), message[1].fileno()]
+             for handoff, message in channels]
+  workers = []
+  for index in range(1, count):
+    receivers = [sock[0].fileno() for sock in channels[index]]
+    # The worker only keeps its own receiving ends
+    others = [sock[0].fileno() for i, pairs in enumerate(channels)
+              if i != index for sock in pairs]
+    env = dict(os.environ)
+    env[SHARD_ENV] = json.dumps([index, receivers, senders])
+    workers.append(subprocess.Popen([sys.executable] + sys.argv, env = env,
+                                    stdin = open(os.devnull),
+                                    close_fds = False,
+                                    preexec_fn = lambda fds = others:
+                                                 _close_fds(fds)))
+  for handoff, message in channels[1:]:
+    handoff[0].close()
+    message[0].close()
+  def stop_workers (event):
+    for worker in workers:
+      try:
+        worker.terminate()
+      except OSError:
+        pass
+  core.addListenerByName("GoingDownEvent", stop_workers)
+  log.info("Started %d OpenFlow workers", count - 1)
+  return Shards(0, count, channels[0][0][0], channels[0][1][0],
+                [(handoff[1], message[1]) for handoff, message in channels])
+
+def _join_workers (count, env):
+  """
+  Returns the Shards of a worker started by _start_workers, from the
+  channels it inherited
+  """
+  index, receivers, senders = json.loads(env)
+  def adopt (fd):
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_DGRAM)
+    os.close(fd)
+    return sock
+  return Shards(index, count, adopt(receivers[0]), adopt(receivers[1]),
+                [(adopt(handoff), adopt(message))
+                 for handoff, message in senders])
+
+
 from pox.lib.recoco.recoco import *
 
-class OpenFlow_01_Task (Task):
+class OpenFlow_01_Task (Task, EventMixin):
   """
   The main recoco thread for listening to openflow messages
+
+  backend is how the connections are waited on: "select" hands every socket
+  to recoco's Select, "epoll" registers each connection once on an epoll
+  object and only hands that to Select, so every wakeup costs O(ready
+  connections) and there is no FD_SETSIZE limit (Linux only).
+
+  shards is the Shards of this worker when running with --workers.
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
+  _eventMixin_events = set([ShardMessage])
+
+  def __init__ (self, port = 6633, address = '0.0.0.0', backend = 'select',
+                shards = None):
+    if backend == 'epoll' and not hasattr(select, 'epoll'):
+      log.warning("epoll is not available, using select")
+      backend = 'select'
+    self.backend = backend
+    if backend == 'epoll':
+      self.run = self._run_epoll
     Task.__init__(self)
     self.port = int(port)
     self.address = address
     self.started = False
+    self.shards = shards
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
@@ -848,12 +1123,35 @@ class OpenFlow_01_Task (Task):
     self.started = True
     return super(OpenFlow_01_Task,self).start()
 
-  def run (self):
-    # List of open sockets/connections to select on
-    sockets = []
+  def send_to_shards (self, message):
+    """
+    Sends a message to the other workers, which raise it as a ShardMessage.
+    It is sent as JSON, so tuples arrive as lists. Does nothing when
+    running a single worker.
+    """
+    if self.shards is not None:
+      self.shards.send(message)
 
+  def _receive_from_shards (self):
+    received = self.shards.receive()
+    if received is not None:
+      self.raiseEventNoErrors(ShardMessage, *received)
+
+  def _shard_sockets (self):
+    if self.shards is None:
+      return []
+    return [self.shards.handoff_socket, self.shards.message_socket]
+
+  def _listen (self):
+    """
+    Returns the listening socket, or None if it can't be bound
+    """
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if self.shards is not None:
+      # Every worker listens on the same port
+      listener.setsockopt(socket.SOL_SOCKET,
+                          getattr(socket, 'SO_REUSEPORT', 15), 1)
     try:
       listener.bind((self.address, self.port))
     except socket.error as (errno, strerror):
@@ -865,25 +1163,61 @@ class OpenFlow_01_Task (Task):
         log.error(" You may have another controller running.")
         log.error(" Use openflow.of_01 --port=<port> to run POX on "
                   "another port.")
-      return
+      return None
 
-    listener.listen(16)
-    sockets.append(listener)
+    # Thousands of switches may connect at once when the controller starts
+    listener.listen(socket.SOMAXCONN)
 
     log.debug("Listening on %s:%s" %
               (self.address, self.port))
+    return listener
+
+  def _accept (self, listener):
+    new_sock = listener.accept()[0]
+    if pox.openflow.debug.pcap_traces:
+      new_sock = wrap_socket(new_sock)
+    new_sock.setblocking(0)
+    # Note that instantiating a Connection object fires a
+    # ConnectionUp event (after negotation has completed)
+    return Connection(new_sock)
+
+  def _log_exception (self, con):
+    doTraceback = True
+    if sys.exc_info()[0] is socket.error:
+      if sys.exc_info()[1][0] == ECONNRESET:
+        con.info("Connection reset")
+        doTraceback = False
+
+    if doTraceback:
+      log.exception("Exception reading connection " + str(con))
+
+  def run (self):
+    global _loop_thread
+    _loop_thread = threading.current_thread()
+    # List of open sockets/connections to select on
+    sockets = []
+
+    listener = self._listen()
+    if listener is None:
+      return
+    sockets.append(listener)
+    shard_sockets = self._shard_sockets()
+    sockets.extend(shard_sockets)
+    sockets.append(_waker)
 
     con = None
     while core.running:
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          # Only the connections with a send queue are waited to be writable
+          rlist, wlist, elist = yield Select(sockets, list(_write_waiting),
+                                             sockets, 5)
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
           for con in elist:
-            if con is listener:
+            if con is listener or con is _waker or con in shard_sockets:
               raise RuntimeError("Error on listener socket")
             else:
               try:
@@ -895,38 +1229,40 @@ class OpenFlow_01_Task (Task):
               except:
                 pass
 
+          for con in wlist:
+            con._send_queued()
+
           timestamp = time.time()
           for con in rlist:
             if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
+              newcon = self._accept(listener)
               sockets.append( newcon )
               #print str(newcon) + " connected"
+            elif con is _waker:
+              # Some connection started waiting to be writable
+              _waker.pongAll()
+            elif con in shard_sockets:
+              if con is self.shards.handoff_socket:
+                sockets.append(self.shards.adopt())
+              else:
+                self._receive_from_shards()
             else:
               con.idle_time = timestamp
               if con.read() is False:
                 con.close()
                 sockets.remove(con)
+          # One send per switch for everything the handlers sent
+          _flush_connections()
       except exceptions.KeyboardInterrupt:
         break
       except:
-        doTraceback = True
-        if sys.exc_info()[0] is socket.error:
-          if sys.exc_info()[1][0] == ECONNRESET:
-            con.info("Connection reset")
-            doTraceback = False
-
-        if doTraceback:
-          log.exception("Exception reading connection " + str(con))
+        self._log_exception(con)
 
         if con is listener:
           log.error("Exception on OpenFlow listener.  Aborting.")
           break
+        if con is _waker or con in shard_sockets:
+          continue
         try:
           con.close()
         except:
@@ -940,6 +1276,122 @@ class OpenFlow_01_Task (Task):
 
     #pox.core.quit()
 
+  def _run_epoll (self):
+    """
+    Same as run(), but each socket is registered once on a (level triggered)
+    epoll object and only the epoll fd is handed to recoco's Select
+    """
+    global _loop_thread
+    _loop_thread = threading.current_thread()
+    listener = self._listen()
+    if listener is None:
+      return
+    poller = select.epoll()
+    poller.register(listener.fileno(), select.EPOLLIN)
+    # File descriptor -> socket of the other workers
+    shard_sockets = dict((sock.fileno(), sock) for sock in self._shard_sockets())
+    for shard_fd in shard_sockets:
+      poller.register(shard_fd, select.EPOLLIN)
+    poller.register(_waker.fileno(), select.EPOLLIN)
+    # File descriptor -> Connection
+    connections = {}
+    # File descriptors of the connections registered for EPOLLOUT
+    writing = set()
+
+    def update_writing ():
+      """
+      Waits for EPOLLOUT only on the connections with a send queue
+      """
+      waiting = set()
+      for con in _write_waiting:
+        fd = con.fileno()
+        if fd in connections:
+          waiting.add(fd)
+      for fd in waiting - writing:
+        poller.modify(fd, select.EPOLLIN | select.EPOLLOUT)
+      for fd in writing - waiting:
+        poller.modify(fd, select.EPOLLIN)
+      writing.clear()
+      writing.update(waiting)
+
+    def drop (fd):
+      writing.discard(fd)
+      con = connections.pop(fd, None)
+      try:
+        poller.unregister(fd)
+      except:
+        pass
+      if con is not None:
+        try:
+          con.close()
+        except:
+          pass
+
+    con = None
+    fd = None
+    while core.running:
+      try:
+        while True:
+          con = None
+          fd = None
+          update_writing()
+          rlist, wlist, elist = yield Select([poller], [], [], 5)
+          if len(rlist) == 0:
+            if not core.running: break
+            continue
+
+          timestamp = time.time()
+          for fd, events in poller.poll(0):
+            if fd == listener.fileno():
+              con = listener
+              if events & (select.EPOLLERR | select.EPOLLHUP):
+                raise RuntimeError("Error on listener socket")
+              newcon = self._accept(listener)
+              connections[newcon.fileno()] = newcon
+              poller.register(newcon.fileno(), select.EPOLLIN)
+              continue
+            if fd in shard_sockets:
+              con = shard_sockets[fd]
+              if con is self.shards.handoff_socket:
+                newcon = self.shards.adopt()
+                connections[newcon.fileno()] = newcon
+                poller.register(newcon.fileno(), select.EPOLLIN)
+              else:
+                self._receive_from_shards()
+              continue
+            if fd == _waker.fileno():
+              # Some connection started waiting to be writable
+              _waker.pongAll()
+              continue
+            con = connections.get(fd)
+            if con is None:
+              drop(fd)
+              continue
+            if events & select.EPOLLOUT:
+              con._send_queued()
+            if events & select.EPOLLIN:
+              con.idle_time = timestamp
+              if con.read() is False:
+                drop(fd)
+            elif events & (select.EPOLLERR | select.EPOLLHUP):
+              # Without data left to read
+              drop(fd)
+          # One send per switch for everything the handlers sent
+          _flush_connections()
+      except exceptions.KeyboardInterrupt:
+        break
+      except:
+        self._log_exception(con)
+
+        if con is listener:
+          log.error("Exception on OpenFlow listener.  Aborting.")
+          break
+        if fd is not None and fd not in shard_sockets:
+          drop(fd)
+
+    poller.close()
+    log.debug("No longer listening for connections")
+
 
 def _set_handlers ():
   handlers.extend([None] * (1 + sorted(handlerMap.keys(),reverse=True)[0]))
@@ -949,19 +1401,112 @@ def _set_handlers ():
 _set_handlers()
 
 
-# Used by the Connection class
-deferredSender = None
+# Wakes up the OpenFlow loop when a connection starts waiting to be
+# writable, see Connection._enqueue
+_waker = None
+# Connections with a send queue
+_write_waiting = set()
+# Connections with buffered messages, see Connection.send
+_unflushed = set()
+_flush_scheduled = False
+# Guards _unflushed, _flush_scheduled and the write buffer of every
+# connection, which other threads fill through Connection.send
+_unflushed_lock = threading.Lock()
+# Thread running the OpenFlow loop (and every recoco task), the only one
+# that writes to the sockets
+_loop_thread = None
+
+def _in_loop_thread ():
+  return threading.current_thread() is _loop_thread
+
+def _schedule_flush ():
+  """
+  Flushes the connections once the current recoco task yields, for the
+  messages sent from outside the OpenFlow loop (timers, other components,
+  other threads)
+  """
+  global _flush_scheduled
+  with _unflushed_lock:
+    if _flush_scheduled: return
+    _flush_scheduled = True
+  core.callLater(_flush_connections)
+
+def _flush_connections ():
+  """
+  Flushes every connection with buffered messages, except the ones in
+  the middle of a batch(), which flush when it ends
+  """
+  global _flush_scheduled
+  with _unflushed_lock:
+    _flush_scheduled = False
+    unflushed = list(_unflushed)
+    _unflushed.clear()
+  # It runs in the recoco thread, from the loop or through callLater
+  for con in unflushed:
+    if con.batching == 0:
+      con._flush()
+# Shards of this worker when running several of them, see launch()
+_shards = None
+
+def _raise_nofile_limit ():
+  """
+  Raises the soft limit of open files up to the hard one, each switch
+  connection takes a file descriptor and the default soft limit is
+  usually 1024
+  """
+  try:
+    import resource
+  except ImportError:
+    return
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  limit = soft
+  if soft != hard:
+    target = hard if hard != resource.RLIM_INFINITY else 1 << 20
+    try:
+      resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+      limit = target
+    except (ValueError, OSError):
+      pass
+  if limit == resource.RLIM_INFINITY:
+    return
+  log.info("Up to %s open files (switch connections)", limit)
+  if limit < 8192:
+    log.warning("The limit of open files is %s, raise it with ulimit -n "
+                "(or the nofile hard limit) for more switches", limit)
 
-def launch (port = 6633, address = "0.0.0.0"):
+def launch (port = 6633, address = "0.0.0.0", backend = "select", workers = 1,
+            read_size = READ_SIZE):
+  """
+  --backend=epoll waits on the switch connections with epoll (Linux) instead
+  of select, for controllers with thousands of switches. It also raises the
+  soft limit of open files (RLIMIT_NOFILE) up to the hard one; beyond that,
+  raise the hard limit with ulimit -n or limits.conf
+  --workers=N runs N POX processes and each switch is handled by the one
+  given by its dpid (see Shards)
+  --read_size=<bytes> is the amount of bytes read from a switch at once
+  """
   if core.hasComponent('of_01'):
     return None
 
-  global deferredSender
-  deferredSender = DeferredSender()
+  global _waker
+  _waker = pox.lib.util.makePinger()
 
   if of._logger is None:
     of._logger = core.getLogger('libopenflow_01')
 
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  Connection.read_size = int(read_size)
+  if backend == 'epoll':
+    _raise_nofile_limit()
+
+  global _shards
+  workers = int(workers)
+  if workers > 1:
+    if SHARD_ENV in os.environ:
+      _shards = _join_workers(workers, os.environ[SHARD_ENV])
+    else:
+      _shards = _start_workers(workers)
+
+  l = OpenFlow_01_Task(port = int(port), address = address, backend = backend,
+                       shards = _shards)
   core.register("of_01", l)
   return l
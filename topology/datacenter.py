@@ -3,45 +3,54 @@ Fattree Topology
 """
 from mininet.topo import Topo
 
+def is_quiet(quiet):
+  # mn --topo pasa los parametros con nombre como strings
+  return quiet in (True, 1, 'True', 'true', '1')
+
 class Datacenter(Topo):
+  def log(self, message):
+    if not self.quiet:
+      print(message)
+
   def create_switches(self, levels):
-    print("Initializing Switches")
+    self.log("Initializing Switches")
     switches_by_level = {}
     i = 1
     for level in range(levels):
        level_switches = []
        for switch in range(2**level):
          level_switches.append(self.addSwitch('sw%d'%(i)))
-         print("Added switch to topology: sw%d_%d"%(level,switch) + "with number: %d"%(i))
+         self.log("Added switch to topology: sw%d_%d"%(level,switch) + "with number: %d"%(i))
          i += 1
        switches_by_level[level] = level_switches
     return switches_by_level
 
   def add_links_to_switches(self, switches_by_level):
-    print("Initializing Links")
+    self.log("Initializing Links")
     for level, switches in switches_by_level.items():
       if level > 0:
         for switch1 in switches_by_level[level-1]:
           for switch2 in switches:
-            print("Added link between: {} and {}".format(switch1, switch2))
+            self.log("Added link between: {} and {}".format(switch1, switch2))
             self.addLink(switch1, switch2)
   
   def add_hosts_to_network(self, switches_by_level):
     root_switch = switches_by_level[0][0]
-    print("Initializing Clients")
+    self.log("Initializing Clients")
     for i in range(3):
       client = self.addHost('client%s'%i)
       self.addLink(root_switch, client)
 
-    print("Initializing Providers")
+    self.log("Initializing Providers")
     last_level = len(switches_by_level)-1
     for i, switch in enumerate(switches_by_level[last_level]):
       host = self.addHost('h%s'%i)
       self.addLink(switch, host)
 
-  def __init__( self, levels = 1, half_ports = 2, **opts ):
+  def __init__( self, levels = 1, half_ports = 2, quiet = False, **opts ):
     Topo.__init__(self, **opts)
-    print("Initializing DataCenter Topology\nLevels: %s"%levels)
+    self.quiet = is_quiet(quiet)
+    self.log("Initializing DataCenter Topology\nLevels: %s"%levels)
 
     switches_by_level = self.create_switches(levels)
 
@@ -50,4 +59,83 @@ class Datacenter(Topo):
     self.add_links_to_switches(switches_by_level)
 
 
-topos = { 'datacenter': Datacenter }
+class NumberedTopo(Topo):
+  """
+  Numera los switches y hosts en el orden en que se crean,
+  asi el dpid de cada switch sale de su nombre
+  """
+  def __init__( self, quiet = False, **opts ):
+    Topo.__init__(self, **opts)
+    self.quiet = is_quiet(quiet)
+    self.switch_count = 0
+    self.host_count = 0
+
+  def add_switch(self):
+    self.switch_count += 1
+    return self.addSwitch('sw%d' % self.switch_count)
+
+  def add_host(self):
+    self.host_count += 1
+    return self.addHost('h%d' % self.host_count)
+
+
+class FatTree(NumberedTopo):
+  """
+  Fat-tree de k puertos: (k/2)^2 switches core y k pods, cada uno con k/2
+  switches de agregacion y k/2 switches edge.
+  Cada agregacion se conecta con todos los edge de su pod y con k/2 cores,
+  asi entre dos edges de pods distintos hay (k/2)^2 caminos de igual costo.
+  Los hosts se conectan a los edge (k/2 por defecto, como en un fat-tree real).
+
+    mn --custom /tmp/topology/datacenter.py --topo fattree,4[,hosts_per_edge][,quiet=True]
+  """
+  def __init__( self, k = 4, hosts_per_edge = None, quiet = False, **opts ):
+    NumberedTopo.__init__(self, quiet, **opts)
+    if k < 2 or k % 2:
+      raise ValueError("k must be an even number greater than 1")
+    half = k // 2
+    if hosts_per_edge is None:
+      hosts_per_edge = half
+
+    cores = [self.add_switch() for _ in range(half * half)]
+    for _ in range(k):
+      aggregations = [self.add_switch() for _ in range(half)]
+      edges = [self.add_switch() for _ in range(half)]
+      for i, aggregation in enumerate(aggregations):
+        for core in cores[i * half:(i + 1) * half]:
+          self.addLink(aggregation, core)
+        for edge in edges:
+          self.addLink(aggregation, edge)
+      for edge in edges:
+        for _ in range(hosts_per_edge):
+          self.addLink(edge, self.add_host())
+
+    if not self.quiet:
+      print("Initializing FatTree Topology\nk: %d, switches: %d, hosts: %d"
+            % (k, self.switch_count, self.host_count))
+
+
+class LeafSpine(NumberedTopo):
+  """
+  Leaf-spine: cada leaf se conecta con todos los spines, asi entre dos leaves
+  hay tantos caminos de igual costo como spines. Los hosts se conectan a los leaves.
+
+    mn --custom /tmp/topology/datacenter.py --topo leafspine,2,4[,hosts_per_leaf][,quiet=True]
+  """
+  def __init__( self, spines = 2, leaves = 4, hosts_per_leaf = 1, quiet = False, **opts ):
+    NumberedTopo.__init__(self, quiet, **opts)
+
+    spine_switches = [self.add_switch() for _ in range(spines)]
+    for _ in range(leaves):
+      leaf = self.add_switch()
+      for spine in spine_switches:
+        self.addLink(leaf, spine)
+      for _ in range(hosts_per_leaf):
+        self.addLink(leaf, self.add_host())
+
+    if not self.quiet:
+      print("Initializing LeafSpine Topology\nspines: %d, leaves: %d, hosts: %d"
+            % (spines, leaves, self.host_count))
+
+
+topos = { 'datacenter': Datacenter, 'fattree': FatTree, 'leafspine': LeafSpine }